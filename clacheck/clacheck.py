@@ -3,26 +3,30 @@
 for the CLA.
 
 Look for <EDIT> comments for pointers on where to customize
-"""
 
-import cgi, cgitb
-import json, urllib.request, urllib.parse, urllib.error, os, re, sys, http.client, hashlib, hmac
+This file is the CGI entry point.  The same processing is available
+from a long-running server, see server.py.
+"""
 
-cgitb.enable()
+import json, urllib.request, urllib.parse, urllib.error, os, sys, hashlib, hmac
+import claindex, decisioncache, ghclient, patchscan
 
 env = os.environ
 textplain = "Content-type: text/plain\n\n"
-what = env.get('HTTP_X_GITHUB_EVENT', 'ping')
-signatures = {
-    'sha256': env.get('HTTP_X_HUB_SIGNATURE_256'),
-}
-From = re.compile("^From:.*<(.*)>")
-Trivial = re.compile("^\s*CLA\s*:\s*TRIVIAL", re.IGNORECASE)
-URLpattern = re.compile("https?://([^/]*)/(.*)")
 SUCCESS = 'success'
 FAILURE = 'failure'
 data_location = env.get('DATA', '/var/cache/openssl/checkouts/data');
 CLAFILE = os.path.join(data_location, 'cladb.txt')
+# Where we keep state between requests, such as the parsed CLA index
+cache_location = env.get('CLACHECK_CACHE', '/var/cache/openssl/clacheck')
+CLAINDEX = os.path.join(cache_location, 'cladb.idx')
+DECISIONS = os.path.join(cache_location, 'decisions.db')
+
+cla_index = claindex.ClaIndex(CLAFILE, CLAINDEX)
+decisions = decisioncache.DecisionCache(DECISIONS)
+# Where to get the commits from: 'api' lists them through the GitHub API
+# when possible, 'patch' always downloads the mbox patch
+commit_source = env.get('CLACHECK_SOURCE', 'api')
 
 CLA_LABEL = 'hold: cla required'
 
@@ -44,96 +48,156 @@ statusbody = """
 # Tokens/secrets: one for authenticating github (incoming) and one for
 # the authentication of this client (outgoing)
 secrets_location=env.get('OSSL_SECRETS', '/var/www')
-incoming_token = open(os.path.join(secrets_location,
-                                   'clacheck-github-sig-secret.dat')).read().strip()
-outgoing_token = open(os.path.join(secrets_location,
-                                   'clacheck-webhook-token.dat')).read().strip()
+incoming_token = None
+outgoing_token = None
+# The GitHub API client, shared by all requests
+github = None
+
+def load_secrets():
+    global incoming_token, outgoing_token, github
+    incoming_token = open(os.path.join(secrets_location,
+                                       'clacheck-github-sig-secret.dat')).read().strip()
+    outgoing_token = open(os.path.join(secrets_location,
+                                       'clacheck-webhook-token.dat')).read().strip()
+    github = ghclient.GitHubClient(outgoing_token)
 
-def url_split(url):
-    m = URLpattern.match(url)
-    return (m.group(1), '/' + m.group(2))
+def log(*args):
+    print(*args, file=sys.stderr)
 
 def update_status(pr, state, description):
+    """Set the cla-check status and the CLA label on |pr|.  Returns a
+    message describing what was done.  Nothing is sent if the same status
+    was already published on the same head commit, and the label is left
+    alone if the state didn't change since the last published status."""
+    repo = pr['base']['repo']['full_name']
+    number = pr['number']
+    sha = pr['head']['sha']
+    last = decisions.last_published(repo, number)
+    if last == (sha, state, description):
+        return "CLA check %s %s (unchanged)" % (state, description)
     d = { 'state': state, 'description': description }
-    headers = {
-            'Authorization': 'token ' + outgoing_token,
-            'User-Agent': 'openssl-machine',
-            'Content-Type': 'application/json; charset=utf-8',
-            'Accept': 'application/json',
-            }
-    host,url = url_split(pr['_links']['statuses']['href'])
-    print(textplain, "CLA check", state, description)
-    conn = http.client.HTTPSConnection(host)
-    conn.request('POST', url, statusbody % d, headers)
-    conn.getresponse().read()
-    host,url = url_split(pr['issue_url'])
+    res = github.request('POST', pr['_links']['statuses']['href'],
+                         statusbody % d)
+    if not res.ok():
+        raise ghclient.GitHubError(res)
+    if last is None or last[1] != state:
+        update_label(pr, state)
+    # Only recorded once both the status and the label are in place, so
+    # that a failure is tried again with the next event
+    decisions.set_published(repo, number, sha, state, description)
+    return "CLA check %s %s" % (state, description)
+
+def update_label(pr, state):
+    """Remove or add the CLA label on |pr|.  Raises GitHubError if that
+    failed; a label that was already removed is fine."""
+    url = pr['issue_url']
     if state == SUCCESS:
         url = url + '/labels/' + urllib.parse.quote(CLA_LABEL)
-        print('Delete', url)
-        conn.request('DELETE', url, None, headers)
+        log('Delete', url)
+        res = github.request('DELETE', url)
+        if not res.ok() and res.status != 404:
+            raise ghclient.GitHubError(res)
     elif state == FAILURE:
         url = url + '/labels'
-        print('Add need-cla', url)
-        conn.set_debuglevel(99)
-        conn.request('POST', url, '[ "{}" ]'.format(CLA_LABEL), headers)
-    reply = conn.getresponse().read()
-    print("--\n", reply)
+        log('Add need-cla', url)
+        res = github.request('POST', url, '[ "{}" ]'.format(CLA_LABEL))
+        if not res.ok():
+            raise ghclient.GitHubError(res)
 
 def have_cla(name):
     """Is |name| in the cladb?"""
-    for line in open(CLAFILE):
-        line = line.strip()
-        if not line or line[0] == '#':
-            continue
-        n = line.split()
-        if len(n) and n[0] == name.lower():
-            return 1
-    return 0
+    return 1 if name in cla_index else 0
 
-def process():
-    payload = sys.stdin.read()
+def scan(pr, patch_url):
+    """Find the authors of |pr|.  Returns a tuple (trivial, authors).  If
+    the commits can't be listed through the API, the patch is scanned
+    instead."""
+    if commit_source == 'api' and patchscan.can_use_api(pr):
+        pages = patchscan.fetch_commit_pages(pr, github.get_json)
+        try:
+            return patchscan.scan_commits(pages)
+        except ghclient.GitHubError as e:
+            log('Listing the commits failed (%s), scanning the patch' % e)
+        finally:
+            pages.close()
+    with urllib.request.urlopen(patch_url) as stream:
+        return patchscan.scan_patch(stream)
+
+def decide(pr, patch_url):
+    """Check the authors of |pr|.  Returns a tuple of the state and the
+    description for the status."""
+    trivial, authors = scan(pr, patch_url)
+    if trivial:
+        return (SUCCESS, "Trivial")
+    missing = [a for a in authors if not have_cla(a)]
+    if len(missing) == 0:
+        return (SUCCESS, 'CLA on file')
+    else:
+        return (FAILURE, "CLA missing: " + str(missing))
 
+def verify_signature(payload, signature):
+    """Does |signature| (the X-Hub-Signature-256 header) match |payload|?"""
     digestname = 'sha256'
     digestmethod = hashlib.sha256
-    incoming_signature = signatures[digestname]
-    if incoming_signature:
-        eval_signature = hmac.new(key=bytes(incoming_token, 'utf-8'),
-                                  msg=bytes(payload, 'utf-8'),
-                                  digestmod=digestmethod).hexdigest()
-    if not (incoming_signature
-            and incoming_signature == (digestname + '=' + eval_signature)):
-        print("Status: 401\n", textplain, "Unauthorized")
-        return
+    if not signature:
+        return False
+    eval_signature = hmac.new(key=bytes(incoming_token, 'utf-8'),
+                              msg=bytes(payload, 'utf-8'),
+                              digestmod=digestmethod).hexdigest()
+    return hmac.compare_digest(signature, digestname + '=' + eval_signature)
+
+def check_event(what, payload, signature):
+    """Verify and look at one GitHub event of type |what|, with the raw
+    JSON |payload| and the |signature| that came with it.  Returns a tuple
+    of the HTTP status code, a text message, and the pull request data if
+    it needs to be evaluated, None otherwise."""
+    if not verify_signature(payload, signature):
+        return (401, "Unauthorized", None)
 
     if what != 'pull_request':
-        print(textplain, "Request", what)
-        return
+        return (200, "Request " + what, None)
     data = json.loads(payload)
     action = data.get('action', None)
     if action is None or action in null_actions:
-        print(textplain, "No-op action", action)
-        return
+        return (200, "No-op action " + str(action), None)
     pr = data.get('pull_request', None)
     if pr is None:
-        print(textplain, "PR data missing")
-        return
-    patch_url = pr.get('patch_url', None)
-    if patch_url is None:
-        print(textplain, "patch_url missing")
-        return
-    missing = {}
-    for line in urllib.request.urlopen(patch_url):
-        line = str(line, 'utf-8')
-        m = Trivial.match(line)
-        if m:
-            update_status(pr, SUCCESS, "Trivial")
-            return
-        m = From.match(line)
-        if m and not have_cla(m.group(1)):
-            missing[m.group(1)] = 1
-    if len(missing) == 0:
-        update_status(pr, SUCCESS, 'CLA on file')
-    else:
-        update_status(pr, FAILURE, "CLA missing: " + str(list(missing.keys())))
+        return (200, "PR data missing", None)
+    if pr.get('patch_url', None) is None:
+        return (200, "patch_url missing", None)
+    return (200, "", pr)
+
+def evaluate(pr):
+    """Check the authors of |pr| and publish the result.  Returns a text
+    message."""
+    cla_index.refresh()
+    repo = pr['base']['repo']['full_name']
+    sha = pr['head']['sha']
+    decision = decisions.get(repo, sha, cla_index.version)
+    if decision is None:
+        decision = decide(pr, pr['patch_url'])
+        decisions.put(repo, sha, cla_index.version, *decision)
+    return update_status(pr, *decision)
+
+def handle(what, payload, signature):
+    """Process one GitHub event, see check_event().  Returns a tuple of the
+    HTTP status code and a text message."""
+    status, message, pr = check_event(what, payload, signature)
+    if pr is None:
+        return (status, message)
+    return (200, evaluate(pr))
+
+def process():
+    """CGI entry point"""
+    payload = sys.stdin.read()
+    status, message = handle(env.get('HTTP_X_GITHUB_EVENT', 'ping'),
+                             payload, env.get('HTTP_X_HUB_SIGNATURE_256'))
+    if status != 200:
+        print("Status: %d" % status)
+    print(textplain, message)
 
-process()
+if __name__ == '__main__':
+    import cgitb
+    cgitb.enable()
+    load_secrets()
+    process()
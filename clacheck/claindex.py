@@ -0,0 +1,120 @@
+"""Indexed view of the CLA database.
+
+The CLA database (cladb.txt) has one entry per line:
+
+    <email> <status> <name...>
+
+where the email may also be of the form *@domain.com to cover a whole
+domain.  Lines starting with # and blank lines are ignored.
+
+ClaIndex parses the file once into a dictionary keyed on the lowercased
+email address, so that lookups are O(1).  The parsed result is kept in
+memory and, if an index file is given, persisted there as JSON together
+with the mtime and size of the source file.  The source is only parsed
+again when its mtime or size changes.  The index file holds nothing but
+data, so whoever can write to it can at worst make lookups wrong, not
+run code in the server.
+"""
+
+import json, os, tempfile, threading
+
+# Bump this whenever the layout of the persisted index changes
+INDEX_FORMAT = 2
+
+def parse(clafile):
+    """Parse |clafile| and return a dictionary of email -> status."""
+    entries = {}
+    with open(clafile) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            n = line.split()
+            entries[n[0].lower()] = n[1] if len(n) > 1 else ''
+    return entries
+
+class ClaIndex:
+    def __init__(self, clafile, indexfile=None):
+        self.clafile = clafile
+        self.indexfile = indexfile
+        self.stamp = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _source_stamp(self):
+        st = os.stat(self.clafile)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load_index(self, stamp):
+        """Return the persisted entries if they match |stamp|, else None."""
+        if not self.indexfile:
+            return None
+        try:
+            with open(self.indexfile) as f:
+                fmt, saved_stamp, entries = json.load(f)
+        except (OSError, TypeError, ValueError):
+            return None
+        if fmt != INDEX_FORMAT or not isinstance(saved_stamp, list) \
+           or tuple(saved_stamp) != stamp or not isinstance(entries, dict):
+            return None
+        return entries
+
+    def _save_index(self, stamp, entries):
+        if not self.indexfile:
+            return
+        # Write to a temporary file and rename, so concurrent readers
+        # never see a partially written index.  Failing to persist is not
+        # fatal, we simply parse again next time.
+        tmp = None
+        try:
+            d = os.path.dirname(self.indexfile) or '.'
+            fd, tmp = tempfile.mkstemp(dir=d, prefix='.claindex')
+            with os.fdopen(fd, 'w') as f:
+                json.dump([INDEX_FORMAT, stamp, entries], f)
+            os.replace(tmp, self.indexfile)
+        except OSError:
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def refresh(self):
+        """Reload the index if the CLA file changed since the last load."""
+        stamp = self._source_stamp()
+        if stamp == self.stamp:
+            return
+        with self.lock:
+            if stamp == self.stamp:
+                return
+            entries = self._load_index(stamp)
+            if entries is None:
+                entries = parse(self.clafile)
+                self._save_index(stamp, entries)
+            self.entries = entries
+            self.stamp = stamp
+
+    @property
+    def version(self):
+        """An opaque string identifying the currently loaded CLA file."""
+        if self.stamp is None:
+            self.refresh()
+        return '%d-%d' % self.stamp
+
+    def status(self, name):
+        """Return the CLA status letter for |name|, or None if there is no
+        CLA on file.  A domain-wide *@domain entry matches every address
+        in that domain."""
+        if self.stamp is None:
+            self.refresh()
+        name = name.lower()
+        entries = self.entries
+        if name in entries:
+            return entries[name]
+        at = name.rfind('@')
+        if at >= 0:
+            return entries.get('*' + name[at:])
+        return None
+
+    def __contains__(self, name):
+        return self.status(name) is not None
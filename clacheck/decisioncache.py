@@ -0,0 +1,95 @@
+"""Persistent cache of CLA decisions.
+
+A decision only depends on the commits of a pull request and on the CLA
+database, so it is cached keyed on (repository, head SHA, CLA index
+version).  Events that don't change the head commit, such as edits or
+reopening, are then answered without looking at the commits again.
+
+The cache also remembers what was last published on each pull request,
+so that status and label updates that wouldn't change anything can be
+skipped.
+
+Errors from the database are not fatal: lookups then simply miss, and
+the pull request is checked as if there were no cache.
+"""
+
+import sqlite3, sys, threading, time
+
+# Decisions older than this are dropped
+MAX_AGE = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    repo TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    version TEXT NOT NULL,
+    state TEXT NOT NULL,
+    description TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (repo, sha, version)
+);
+CREATE TABLE IF NOT EXISTS published (
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    sha TEXT NOT NULL,
+    state TEXT NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY (repo, number)
+);
+"""
+
+class DecisionCache:
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.local = threading.local()
+        self.initialized = False
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.dbfile, timeout=30)
+            if not self.initialized:
+                db.executescript(SCHEMA)
+                self.initialized = True
+            self.local.db = db
+        return db
+
+    def _fetch(self, query, args):
+        try:
+            row = self._db().execute(query, args).fetchone()
+        except sqlite3.Error as e:
+            print('Decision cache:', e, file=sys.stderr)
+            return None
+        return tuple(row) if row else None
+
+    def _store(self, *statements):
+        try:
+            with self._db() as db:
+                for query, args in statements:
+                    db.execute(query, args)
+        except sqlite3.Error as e:
+            print('Decision cache:', e, file=sys.stderr)
+
+    def get(self, repo, sha, version):
+        """Return the cached (state, description) or None."""
+        return self._fetch('SELECT state, description FROM decisions'
+                           ' WHERE repo = ? AND sha = ? AND version = ?',
+                           (repo, sha, version))
+
+    def put(self, repo, sha, version, state, description):
+        now = int(time.time())
+        self._store(('INSERT OR REPLACE INTO decisions'
+                     ' VALUES (?, ?, ?, ?, ?, ?)',
+                     (repo, sha, version, state, description, now)),
+                    ('DELETE FROM decisions WHERE created < ?',
+                     (now - MAX_AGE,)))
+
+    def last_published(self, repo, number):
+        """Return the last published (sha, state, description) or None."""
+        return self._fetch('SELECT sha, state, description FROM published'
+                           ' WHERE repo = ? AND number = ?', (repo, number))
+
+    def set_published(self, repo, number, sha, state, description):
+        self._store(('INSERT OR REPLACE INTO published'
+                     ' VALUES (?, ?, ?, ?, ?)',
+                     (repo, number, sha, state, description)))
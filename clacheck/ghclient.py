@@ -0,0 +1,179 @@
+"""A small GitHub API client for clacheck.
+
+Connections are kept alive and pooled per host, so that a long-running
+server reuses its TLS sessions across requests instead of doing a fresh
+handshake for every call.  GET responses are cached together with their
+ETag, and repeated with If-None-Match; a 304 reply is answered from the
+cache and does not count against the rate limit.  When GitHub says the
+rate limit is exhausted, the request is retried after the advertised
+delay, as long as that is reasonably short.
+"""
+
+import http.client, json, queue, sys, threading, time, urllib.parse
+from collections import OrderedDict
+
+class Response:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def json(self):
+        return json.loads(self.body)
+
+class GitHubError(Exception):
+    def __init__(self, response):
+        super().__init__('%d %s' % (response.status, response.reason))
+        self.response = response
+
+    def permanent(self):
+        """Would the request fail the same way if it was repeated?  That
+        is the case of client errors, other than timeouts and rate
+        limits."""
+        res = self.response
+        if not 400 <= res.status < 500 or res.status in (408, 429):
+            return False
+        return not (res.status == 403
+                    and (res.headers.get('X-RateLimit-Remaining') == '0'
+                         or 'Retry-After' in res.headers))
+
+class GitHubClient:
+    def __init__(self, token, user_agent='openssl-machine',
+                 max_idle=4, timeout=30, max_wait=60, max_retries=3,
+                 cache_size=256):
+        """|max_idle| is the number of idle connections kept per host.
+        Rate limited requests are retried up to |max_retries| times, if
+        the delay asked for is at most |max_wait| seconds."""
+        self.headers = {
+            'Authorization': 'token ' + token,
+            'User-Agent': user_agent,
+            'Accept': 'application/json',
+        }
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.cache_size = cache_size
+        self.pools = {}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _pool(self, host):
+        with self.lock:
+            pool = self.pools.get(host)
+            if pool is None:
+                pool = self.pools[host] = queue.LifoQueue(self.max_idle)
+            return pool
+
+    def _get_connection(self, host):
+        try:
+            return (self._pool(host).get_nowait(), True)
+        except queue.Empty:
+            return (http.client.HTTPSConnection(host, timeout=self.timeout),
+                    False)
+
+    def _put_connection(self, host, conn):
+        try:
+            self._pool(host).put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _send(self, method, host, path, body, headers):
+        conn, reused = self._get_connection(host)
+        try:
+            conn.request(method, path, body, headers)
+            res = conn.getresponse()
+            data = res.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection, try again
+            # once on a fresh one
+            conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+            conn.request(method, path, body, headers)
+            res = conn.getresponse()
+            data = res.read()
+        if res.will_close:
+            conn.close()
+        else:
+            self._put_connection(host, conn)
+        return Response(res.status, res.reason, res.headers, data)
+
+    def _rate_limit_wait(self, res):
+        """If |res| says we're rate limited, return how many seconds to
+        wait before retrying, otherwise None."""
+        if res.status not in (403, 429):
+            return None
+        retry_after = res.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return max(int(retry_after), 1)
+            except ValueError:
+                return None
+        if res.headers.get('X-RateLimit-Remaining') == '0':
+            reset = res.headers.get('X-RateLimit-Reset')
+            if reset is not None:
+                try:
+                    return max(int(reset) - int(time.time()), 1)
+                except ValueError:
+                    pass
+            return self.max_wait
+        return None
+
+    def request(self, method, url, body=None, headers=None):
+        """Perform a request on |url|, a full https URL.  |body| is sent
+        as is if it's a string or bytes, otherwise it's encoded as JSON.
+        Returns a Response."""
+        u = urllib.parse.urlsplit(url)
+        path = u.path + ('?' + u.query if u.query else '')
+        h = dict(self.headers)
+        if body is not None:
+            if not isinstance(body, (str, bytes)):
+                body = json.dumps(body)
+            h['Content-Type'] = 'application/json; charset=utf-8'
+        if headers:
+            h.update(headers)
+
+        cached = None
+        if method == 'GET':
+            with self.lock:
+                cached = self.cache.get(url)
+            if cached is not None:
+                h['If-None-Match'] = cached.headers['ETag']
+
+        for attempt in range(self.max_retries + 1):
+            res = self._send(method, u.netloc, path, body, h)
+            wait = self._rate_limit_wait(res)
+            if wait is None or wait > self.max_wait \
+               or attempt == self.max_retries:
+                break
+            print('Rate limited, retrying in %d seconds' % wait,
+                  file=sys.stderr)
+            time.sleep(wait)
+
+        if cached is not None and res.status == 304:
+            return cached
+        if method == 'GET' and res.status == 200 and 'ETag' in res.headers:
+            with self.lock:
+                self.cache[url] = res
+                self.cache.move_to_end(url)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if not res.ok():
+            print('%s %s: %d %s' % (method, url, res.status, res.reason),
+                  res.body, file=sys.stderr)
+        return res
+
+    def get_json(self, url):
+        """GET |url| and return the decoded JSON.  Raises GitHubError if
+        the response is not OK."""
+        res = self.request('GET', url)
+        if not res.ok():
+            raise GitHubError(res)
+        return res.json()
@@ -0,0 +1,184 @@
+"""Durable job queue for clacheck.
+
+The web hook only verifies and enqueues events, and a pool of worker
+threads evaluates them afterwards, so GitHub gets its reply right away
+however long the evaluation takes.
+
+Jobs are kept in an SQLite database and survive restarts.  Each job has
+a key, and enqueuing a job with the key of one that is still queued
+replaces its payload, so a burst of events for the same pull request
+results in only one evaluation, of the latest event.  If that happens
+while the job is being processed, it is run once more afterwards.
+
+A job that fails is retried with exponential backoff, and dropped after
+a number of attempts.  A job that fails with PermanentError is dropped
+right away, since it would only fail the same way again.  A job that
+was claimed by a worker which never finished it, for example because
+the server was restarted, is picked up again once the claim has timed
+out.
+"""
+
+import sqlite3, sys, threading, time, traceback
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL,
+    claimed REAL
+);
+"""
+
+class PermanentError(Exception):
+    """Raised by a job function when retrying the job is pointless."""
+
+class Job:
+    def __init__(self, id, key, payload, generation, attempts):
+        self.id = id
+        self.key = key
+        self.payload = payload
+        self.generation = generation
+        self.attempts = attempts
+
+class JobQueue:
+    def __init__(self, dbfile, max_attempts=6, backoff=30, max_backoff=3600,
+                 poll_interval=5, claim_timeout=600):
+        """A failed job is retried after |backoff| seconds, doubling each
+        time up to |max_backoff|, until it has been tried |max_attempts|
+        times."""
+        self.dbfile = dbfile
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.dbfile, timeout=30,
+                                 isolation_level=None)
+            self.local.db = db
+        return db
+
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        return db
+
+    def enqueue(self, key, payload):
+        db = self._db()
+        db.execute('INSERT INTO jobs (key, payload, not_before)'
+                   ' VALUES (?, ?, ?)'
+                   ' ON CONFLICT (key) DO UPDATE'
+                   ' SET payload = excluded.payload,'
+                   '     generation = generation + 1,'
+                   '     attempts = 0,'
+                   '     not_before = excluded.not_before',
+                   (key, payload, time.time()))
+        self.wakeup.set()
+
+    def claim(self):
+        """Take the next job that is due, or return None."""
+        db = self._transaction()
+        now = time.time()
+        try:
+            row = db.execute('SELECT id, key, payload, generation, attempts'
+                             ' FROM jobs'
+                             ' WHERE (claimed IS NULL OR claimed < ?)'
+                             '   AND not_before <= ?'
+                             ' ORDER BY not_before LIMIT 1',
+                             (now - self.claim_timeout, now)).fetchone()
+            if row is not None:
+                db.execute('UPDATE jobs SET claimed = ? WHERE id = ?',
+                           (now, row[0]))
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+        return Job(*row) if row else None
+
+    def done(self, job):
+        """Remove |job|, unless it was replaced while it was running."""
+        db = self._transaction()
+        db.execute('DELETE FROM jobs WHERE id = ? AND generation = ?',
+                   (job.id, job.generation))
+        db.execute('UPDATE jobs SET claimed = NULL WHERE id = ?', (job.id,))
+        db.execute('COMMIT')
+
+    def failed(self, job):
+        """Schedule |job| to be retried, or drop it if it has been tried
+        too many times.  Returns True if it will be retried."""
+        attempts = job.attempts + 1
+        db = self._transaction()
+        if attempts >= self.max_attempts:
+            db.execute('DELETE FROM jobs WHERE id = ? AND generation = ?',
+                       (job.id, job.generation))
+            retry = False
+        else:
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+            db.execute('UPDATE jobs SET attempts = ?,'
+                       ' not_before = ? WHERE id = ? AND generation = ?',
+                       (attempts, time.time() + delay, job.id, job.generation))
+            retry = True
+        # Also releases the job if it was replaced while it was running
+        db.execute('UPDATE jobs SET claimed = NULL WHERE id = ?', (job.id,))
+        db.execute('COMMIT')
+        return retry
+
+    def run(self, job, fn):
+        """Process |job| with |fn|, and remove it or schedule its retry."""
+        try:
+            fn(job.payload)
+        except PermanentError:
+            traceback.print_exc()
+            self.done(job)
+            print('Job %s dropped, it cannot succeed' % job.key,
+                  file=sys.stderr)
+        except Exception:
+            traceback.print_exc()
+            if self.failed(job):
+                print('Job %s will be retried' % job.key,
+                      file=sys.stderr)
+            else:
+                print('Job %s dropped after %d attempts'
+                      % (job.key, self.max_attempts), file=sys.stderr)
+        else:
+            self.done(job)
+
+    def work(self, fn):
+        """Process jobs with |fn| forever.  |fn| is called with the payload
+        of each job; if it raises an exception, the job is retried, unless
+        it's a PermanentError.  Errors of the queue itself, such as a
+        locked database, are logged and the worker carries on after a
+        pause."""
+        while True:
+            try:
+                job = self.claim()
+                if job is None:
+                    self.wakeup.wait(self.poll_interval)
+                    self.wakeup.clear()
+                    continue
+                self.run(job, fn)
+            except Exception:
+                traceback.print_exc()
+                db = self._db()
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                print('Job queue error, carrying on in %d seconds'
+                      % self.poll_interval, file=sys.stderr)
+                time.sleep(self.poll_interval)
+
+    def start_workers(self, fn, count):
+        """Start |count| threads running work(|fn|)."""
+        for i in range(count):
+            t = threading.Thread(target=self.work, args=(fn,),
+                                 name='clacheck-worker-%d' % i, daemon=True)
+            t.start()
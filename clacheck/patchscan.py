@@ -0,0 +1,93 @@
+"""Find the authors of a pull request, and whether it is marked trivial.
+
+There are two sources for this:
+
+scan_patch() reads the mbox formatted patch that GitHub serves for a
+pull request.  It tracks the commit boundaries and only looks at the
+headers (for From:) and the commit message (for CLA: trivial) of each
+commit.  Diff lines are only checked for the start of the next commit.
+As soon as a commit is marked trivial the decision is final, and the
+rest of the patch is not read.
+
+scan_commits() instead fetches the commit list of the pull request from
+the GitHub API, one page of 100 commits per request, with the pages
+fetched in parallel.  This never downloads the diffs at all.
+"""
+
+import math, re
+from concurrent.futures import ThreadPoolExecutor
+
+Boundary = re.compile(rb"^From [0-9a-f]{40} ")
+From = re.compile("^From:.*<(.*)>")
+Trivial = re.compile(r"^\s*CLA\s*:\s*TRIVIAL", re.IGNORECASE)
+TrivialMessage = re.compile(r"^\s*CLA\s*:\s*TRIVIAL", re.IGNORECASE | re.MULTILINE)
+
+# The GitHub API lists at most this many commits for a pull request
+MAX_API_COMMITS = 250
+PER_PAGE = 100
+
+# Where we are within a commit in the mbox
+HEADER, MESSAGE, DIFF = range(3)
+
+def scan_patch(stream):
+    """Scan |stream|, an iterable of the byte lines of an mbox formatted
+    patch.  Returns a tuple (trivial, authors) where |authors| is a list
+    of the author addresses found, in order and without duplicates.  If
+    |trivial| is true, scanning stopped early and |authors| is
+    incomplete."""
+    authors = {}
+    region = DIFF
+    for line in stream:
+        if region == DIFF:
+            if Boundary.match(line):
+                region = HEADER
+            continue
+        line = str(line, 'utf-8', 'replace')
+        if region == HEADER:
+            if not line.strip():
+                region = MESSAGE
+                continue
+            m = From.match(line)
+            if m:
+                authors[m.group(1)] = 1
+        else:
+            if line.rstrip('\r\n') == '---':
+                region = DIFF
+            elif Trivial.match(line):
+                return (True, list(authors))
+    return (False, list(authors))
+
+def scan_commits(pages):
+    """Scan |pages|, an iterable of pages of commits as returned by the
+    GitHub API.  Returns the same as scan_patch()."""
+    authors = {}
+    for page in pages:
+        for c in page:
+            commit = c['commit']
+            if TrivialMessage.search(commit['message']):
+                return (True, list(authors))
+            authors[commit['author']['email']] = 1
+    return (False, list(authors))
+
+def can_use_api(pr):
+    """Can the commits of |pr| be listed completely through the API?"""
+    return ('commits_url' in pr
+            and 0 < pr.get('commits', 0) <= MAX_API_COMMITS)
+
+def fetch_commit_pages(pr, fetch, max_workers=4):
+    """Generate the pages of commits of |pr|, in order.  The pages are
+    fetched in parallel with up to |max_workers| requests at a time.
+    |fetch| is called with the URL of each page and must return the
+    decoded JSON.  If the generator is closed early, pages not yet
+    started are not fetched."""
+    npages = math.ceil(pr['commits'] / PER_PAGE)
+    urls = ['%s?per_page=%d&page=%d' % (pr['commits_url'], PER_PAGE, n)
+            for n in range(1, npages + 1)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, url) for url in urls]
+        try:
+            for f in futures:
+                yield f.result()
+        finally:
+            for f in futures:
+                f.cancel()
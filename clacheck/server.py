@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+"""Long-running server for the CLA check GitHub web hook.
+
+This runs the same processing as the clacheck.py CGI script, but the
+secrets and the CLA index are loaded once at start-up instead of for
+every request, and events are handled concurrently, one thread each.
+
+It can be run standalone:
+
+    server.py --port 8080
+
+or through any WSGI container, using |application| from this module.
+
+With --workers N (or CLACHECK_WORKERS=N in the environment), events are
+only verified and put in a durable queue, GitHub gets a 202 reply right
+away, and N worker threads evaluate the queued pull requests.  Several
+events for the same pull request that are waiting in the queue are
+evaluated only once.
+"""
+
+import argparse, json, os, sys
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer
+
+import clacheck, ghclient, jobqueue
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+statuses = {
+    200: '200 OK',
+    202: '202 Accepted',
+    401: '401 Unauthorized',
+    405: '405 Method Not Allowed',
+}
+
+def application(environ, start_response):
+    if environ['REQUEST_METHOD'] != 'POST':
+        status, message = (405, "POST only")
+    else:
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        payload = str(environ['wsgi.input'].read(length), 'utf-8')
+        what = environ.get('HTTP_X_GITHUB_EVENT', 'ping')
+        signature = environ.get('HTTP_X_HUB_SIGNATURE_256')
+        if jobs is None:
+            status, message = clacheck.handle(what, payload, signature)
+        else:
+            status, message = enqueue(what, payload, signature)
+    body = bytes(message + "\n", 'utf-8')
+    start_response(statuses.get(status, str(status)),
+                   [('Content-Type', 'text/plain; charset=utf-8'),
+                    ('Content-Length', str(len(body)))])
+    return [body]
+
+def enqueue(what, payload, signature):
+    status, message, pr = clacheck.check_event(what, payload, signature)
+    if pr is None:
+        return (status, message)
+    key = '%s#%d' % (pr['base']['repo']['full_name'], pr['number'])
+    jobs.enqueue(key, json.dumps(pr))
+    return (202, "Queued " + key)
+
+def run_job(payload):
+    try:
+        print(clacheck.evaluate(json.loads(payload)), file=sys.stderr)
+    except ghclient.GitHubError as e:
+        if e.permanent():
+            raise jobqueue.PermanentError(str(e)) from e
+        raise
+
+jobs = None
+
+def start_workers(count):
+    global jobs
+    jobs = jobqueue.JobQueue(os.path.join(clacheck.cache_location, 'jobs.db'))
+    jobs.start_workers(run_job, count)
+
+clacheck.load_secrets()
+clacheck.cla_index.refresh()
+workers = int(clacheck.env.get('CLACHECK_WORKERS', '0'))
+if workers > 0 and __name__ != '__main__':
+    start_workers(workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve the CLA check web hook over HTTP')
+    parser.add_argument('--address', '-a', default='',
+                        help='address to listen on (default: all)')
+    parser.add_argument('--port', '-p', type=int, default=8080,
+                        help='port to listen on (default: 8080)')
+    parser.add_argument('--workers', '-w', type=int, default=workers,
+                        help='queue events and evaluate them with this'
+                        ' many worker threads (default: 0, no queue)')
+    args = parser.parse_args()
+    if args.workers > 0:
+        start_workers(args.workers)
+
+    httpd = make_server(args.address, args.port, application,
+                        server_class=ThreadingWSGIServer)
+    print("Serving on %s:%d" % (args.address or '*', args.port),
+          file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
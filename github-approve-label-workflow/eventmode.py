@@ -0,0 +1,175 @@
+# requires python 3
+#
+# Event driven mode for the approval label workflow.
+#
+# Instead of polling every candidate PR's timeline, we listen for the
+# GitHub webhook events that can change the outcome of checkpr(): label
+# changes, comments, new commits and reviews.  Each event is applied to
+# the PR's state as it arrives, and PRs with the "approval: done" label
+# get a timer for 24 hours after the label was given.  When the timer
+# fires the PR is checked from its state alone, without any request to
+# GitHub unless the labels are actually moved.
+#
+# The webhook must be configured to send "Pull requests", "Issue
+# comments" and "Pull request reviews" events, with a secret.
+#
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer
+from prstate import PRState
+from timerwheel import TimerWheel
+
+# when the 24 hours are up, counted from the label
+approvaldelay = 24 * 3600
+
+# how long to wait before checking a PR again after the check failed,
+# doubled after each failure in a row, up to the maximum
+retrydelay = 60
+maxretrydelay = 3600
+
+def isonow():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# Convert a webhook payload to the REST timeline event it stands for, and
+# return the PR number and the event, or None if it's of no interest
+
+def timelineevent(what, payload):
+    action = payload.get('action')
+    if what == 'pull_request':
+        pr = payload['pull_request']['number']
+        if action in ('labeled', 'unlabeled'):
+            return (pr, {'event': action,
+                         'label': {'name': payload['label']['name']},
+                         'created_at': isonow()})
+        if action == 'synchronize':
+            return (pr, {'event': 'committed',
+                         'author': {'date': isonow()}})
+    elif what == 'issue_comment':
+        if 'pull_request' in payload['issue'] \
+           and action in ('created', 'edited'):
+            return (payload['issue']['number'],
+                    {'event': 'commented',
+                     'updated_at': payload['comment']['updated_at']})
+    elif what == 'pull_request_review':
+        if action == 'submitted':
+            review = payload['review']
+            return (payload['pull_request']['number'],
+                    {'event': 'reviewed', 'state': review['state'].lower(),
+                     'submitted_at': review['submitted_at']})
+    return None
+
+class ApprovalTracker:
+    # |states| is a dictionary of PR number -> PRState to start from,
+    # |store| an optional StateStore to save changes in, and |check| is
+    # called with a PR number and its state when its timer fires
+
+    def __init__(self, states, check, store=None, tick=60, debug=False):
+        self.states = states
+        self.check = check
+        self.store = store
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.failures = {}      # PR number -> failed checks in a row
+        self.wheel = TimerWheel(time.time(), tick)
+        for pr, state in states.items():
+            self.reschedule(pr, state)
+
+    def reschedule(self, pr, state):
+        if 'approval: done' in state.labels \
+           and 'approval: ready to merge' not in state.labels:
+            due = state.labels['approval: done'].timestamp() + approvaldelay
+            self.wheel.schedule(pr, due)
+            if self.debug:
+                print("debug: PR", pr, "due at",
+                      datetime.fromtimestamp(due, timezone.utc))
+        else:
+            self.wheel.cancel(pr)
+
+    # Only PRs with an approval label are of interest, the others are
+    # neither kept nor saved
+
+    def tracked(self, state):
+        return any(name.startswith('approval: ') for name in state.labels)
+
+    def event(self, what, payload):
+        found = timelineevent(what, payload)
+        if found is None:
+            return "ignored"
+        pr, event = found
+        with self.lock:
+            state = self.states.get(pr) or PRState()
+            state.apply(event, self.debug)
+            self.reschedule(pr, state)
+            if self.tracked(state):
+                self.states[pr] = state
+                if self.store:
+                    self.store.save(pr, state)
+            elif pr in self.states:
+                del self.states[pr]
+                if self.store:
+                    self.store.forget(pr)
+        return "PR %d: %s" % (pr, event['event'])
+
+    # A check that fails is retried later, with a delay that grows with
+    # each failure in a row, so one bad PR doesn't stop the others
+
+    def runtimers(self):
+        while True:
+            with self.lock:
+                due = [(pr, self.states[pr])
+                       for pr in self.wheel.advance(time.time())
+                       if pr in self.states]
+            for pr, state in due:
+                try:
+                    print(pr, self.check(pr, state))
+                    self.failures.pop(pr, None)
+                except Exception as e:
+                    n = self.failures[pr] = self.failures.get(pr, 0) + 1
+                    delay = min(retrydelay * 2 ** (n - 1), maxretrydelay)
+                    print("PR", pr, "check failed:", e,
+                          "- retrying in", delay, "seconds", file=sys.stderr)
+                    with self.lock:
+                        if pr in self.states:
+                            self.wheel.schedule(pr, time.time() + delay)
+            time.sleep(self.wheel.tick)
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+# Receive webhooks on |port| and feed them to |tracker|, while running its
+# timers.  |secret| is the webhook secret.
+
+def serve(tracker, port, secret):
+    def application(environ, start_response):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        payload = environ['wsgi.input'].read(length)
+        signature = environ.get('HTTP_X_HUB_SIGNATURE_256') or ''
+        expected = 'sha256=' + hmac.new(secret, payload,
+                                        hashlib.sha256).hexdigest()
+        if environ['REQUEST_METHOD'] != 'POST':
+            status, message = '405 Method Not Allowed', "POST only"
+        elif not hmac.compare_digest(signature, expected):
+            status, message = '401 Unauthorized', "Unauthorized"
+        else:
+            what = environ.get('HTTP_X_GITHUB_EVENT', 'ping')
+            status = '200 OK'
+            message = tracker.event(what, json.loads(payload))
+        body = bytes(message + "\n", 'utf-8')
+        start_response(status, [('Content-Type', 'text/plain; charset=utf-8'),
+                                 ('Content-Length', str(len(body)))])
+        return [body]
+
+    threading.Thread(target=tracker.runtimers, daemon=True).start()
+    httpd = make_server('', port, application,
+                        server_class=ThreadingWSGIServer)
+    print("Listening for webhooks on port", port, file=sys.stderr)
+    httpd.serve_forever()
@@ -0,0 +1,109 @@
+# requires python 3
+#
+# Fetch the timelines of many pull requests at once through the GitHub
+# GraphQL API.
+#
+# One query covers a batch of PRs, each as an aliased sub-query, and only
+# asks for the timeline item types and fields that checkpr() looks at.
+# The items are converted to the same shape as the REST timeline events,
+# so checkpr() can handle either.  PRs with more than 100 timeline items
+# are fetched further in following rounds, again batched together.
+#
+# The GraphQL API needs an authentication token.
+#
+import json
+
+graphql_url = "https://api.github.com/graphql"
+
+timeline_query = """
+    pr%(number)d: pullRequest(number: %(number)d) {
+      timelineItems(first: 100%(after)s, itemTypes: [ISSUE_COMMENT,
+          PULL_REQUEST_COMMIT, LABELED_EVENT, UNLABELED_EVENT,
+          PULL_REQUEST_REVIEW]) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          __typename
+          ... on IssueComment { updatedAt }
+          ... on PullRequestCommit { commit { author { date } } }
+          ... on LabeledEvent { createdAt label { name } }
+          ... on UnlabeledEvent { createdAt label { name } }
+          ... on PullRequestReview { state submittedAt }
+        }
+      }
+    }
+"""
+
+# Convert a GraphQL timeline item to the equivalent REST timeline event
+
+def restevent(node):
+    t = node['__typename']
+    if t == 'IssueComment':
+        return {'event': 'commented', 'updated_at': node['updatedAt']}
+    if t == 'PullRequestCommit':
+        return {'event': 'committed',
+                'author': {'date': node['commit']['author']['date']}}
+    if t == 'LabeledEvent' or t == 'UnlabeledEvent':
+        return {'event': 'labeled' if t == 'LabeledEvent' else 'unlabeled',
+                'label': {'name': node['label']['name']},
+                'created_at': node['createdAt']}
+    if t == 'PullRequestReview':
+        return {'event': 'reviewed', 'state': node['state'].lower(),
+                'submitted_at': node['submittedAt']}
+    return {'event': t}
+
+def buildquery(repo, cursors):
+    owner, name = repo.split('/')
+    subqueries = []
+    for number, after in cursors.items():
+        subqueries.append(timeline_query % {
+            'number': number,
+            'after': ', after: ' + json.dumps(after) if after else ''})
+    return ('query {\n  repository(owner: %s, name: %s) {%s  }\n}\n'
+            % (json.dumps(owner), json.dumps(name), ''.join(subqueries)))
+
+# Fetch the timelines of all |prs| in |repo|, |batch| PRs per query.
+# |cursors| optionally gives, per PR, the cursor to start after.  Returns
+# a dictionary of PR number -> (events, cursor), where |cursor| is the
+# position of the last item seen.  For PRs that couldn't be fetched,
+# events is an error object with a 'message', like the REST API returns.
+
+def fetchtimelines(gh, repo, prs, batch=20, cursors=None, debug=False):
+    cursors = dict(cursors or {})
+    timelines = {pr: ([], cursors.get(pr)) for pr in prs}
+    pending = {pr: cursors.get(pr) for pr in prs}
+    while pending:
+        numbers = list(pending)
+        for i in range(0, len(numbers), batch):
+            chunk = {n: pending[n] for n in numbers[i:i + batch]}
+            if debug:
+                print("debug: fetching timelines of", list(chunk))
+            res = gh.post(graphql_url,
+                          data=json.dumps({'query': buildquery(repo, chunk)}))
+            # An error page, such as a 502 for a query that took too
+            # long, fails this chunk like an "errors" reply does
+            try:
+                reply = res.json()
+            except ValueError:
+                reply = {}
+            if not res.ok and not reply.get('errors'):
+                reply = {'message': '%d %s' % (res.status_code,
+                                               reply.get('message') or res.reason)}
+            data = (reply.get('data') or {}).get('repository') or {}
+            errors = reply.get('errors') or [{'message': reply.get('message',
+                                                                  'no data')}]
+            for n in chunk:
+                pr = data.get('pr%d' % n)
+                if pr is None:
+                    timelines[n] = ({'message': errors[0]['message']}, None)
+                    del pending[n]
+                    continue
+                items = pr['timelineItems']
+                events, cursor = timelines[n]
+                events.extend(restevent(node) for node in items['nodes'])
+                cursor = items['pageInfo']['endCursor'] or cursor
+                timelines[n] = (events, cursor)
+                if items['pageInfo']['hasNextPage']:
+                    pending[n] = cursor
+                else:
+                    del pending[n]
+    return timelines
@@ -0,0 +1,99 @@
+# requires python 3
+#
+# A shared GitHub API session for the approval label workflow.
+#
+# All requests go through one requests.Session, so connections are kept
+# alive and reused between threads.  At most |parallel| requests are in
+# flight at the same time, and requests that hit the primary or secondary
+# rate limit are retried after the delay GitHub asks for.
+#
+import sys
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+class GitHubError(Exception):
+    def __init__(self, res):
+        try:
+            message = res.json().get('message')
+        except ValueError:
+            message = None
+        super().__init__("%d %s" % (res.status_code, message or res.reason))
+        self.response = res
+
+class GitHubSession:
+    def __init__(self, headers, parallel=4, max_wait=300, max_retries=5,
+                 debug=False):
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=parallel)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.debug = debug
+
+    # How long GitHub wants us to wait, or None if we're not rate limited.
+    # The secondary rate limit comes with a Retry-After header, the
+    # primary one with X-RateLimit-Remaining: 0.
+
+    def ratelimitwait(self, res):
+        if res.status_code not in (403, 429):
+            return None
+        if 'Retry-After' in res.headers:
+            try:
+                return max(int(res.headers['Retry-After']), 1)
+            except ValueError:
+                return None
+        if res.headers.get('X-RateLimit-Remaining') == '0':
+            try:
+                return max(int(res.headers['X-RateLimit-Reset']) - time.time(), 1)
+            except (KeyError, ValueError):
+                return self.max_wait
+        if b'secondary rate limit' in res.content:
+            return 60
+        return None
+
+    def request(self, method, url, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            with self.slots:
+                res = self.session.request(method, url, **kwargs)
+            wait = self.ratelimitwait(res)
+            if wait is None or wait > self.max_wait or attempt == self.max_retries:
+                return res
+            if self.debug:
+                print("debug: rate limited, waiting", int(wait), "seconds",
+                      file=sys.stderr)
+            time.sleep(wait)
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    # Get all pages of a list.  Search results are wrapped in an object,
+    # in which case |key| names the member that holds the list.  Raises
+    # GitHubError, with GitHub's message, if any page can't be had.
+
+    def getall(self, url, key=None):
+        res = self.getpage(url)
+        items = res.json()
+        if key is not None:
+            items = items[key]
+        while 'next' in res.links.keys():
+            res = self.getpage(res.links['next']['url'])
+            page = res.json()
+            items.extend(page[key] if key is not None else page)
+        return items
+
+    def getpage(self, url):
+        res = self.get(url)
+        if not res.ok:
+            raise GitHubError(res)
+        return res
@@ -12,122 +12,103 @@
 #
 # mark@openssl.org Feb 2020
 #
-import requests
-import json
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from optparse import OptionParser
+from ghsession import GitHubSession, GitHubError
+import ghgraphql
+import eventmode
+from prstate import PRState, StateStore
+from mutations import LabelMover, MoveError
 
-api_url = "https://api.github.com/repos/openssl/openssl"
+repo = "openssl/openssl"
+api_url = "https://api.github.com/repos/" + repo
+search_url = "https://api.github.com/search/issues"
 
-def convertdate(date):
-    return datetime.strptime(date.replace('Z',"+0000"), "%Y-%m-%dT%H:%M:%S%z")
-
-# Get all the open pull requests, filtering by approval: done label
+# Get all the open pull requests with the approval: done label.  We let the
+# search API do the filtering, so we only get the PRs we're interested in
+# rather than every open PR; we can parse everything for statistics in
+# another script
 
 def getpullrequests():
-    url = api_url + "/pulls?per_page=100&page=1"  # defaults to open
-    res = requests.get(url, headers=headers)
-    repos = res.json()
+    q = 'repo:' + repo + ' is:pr is:open label:"approval: done"'
+    url = search_url + "?per_page=100&q=" + urllib.parse.quote(q)
     prs = []
-    while 'next' in res.links.keys():
-        res = requests.get(res.links['next']['url'], headers=headers)
-        repos.extend(res.json())
-
-    # Let's filter by label if we're just looking to move things, we can parse
-    # everything for statistics in another script
 
     try:
-        for pr in repos:
-            if 'labels' in pr:
-                for label in pr['labels']:
-                    if label['name'] == 'approval: done':
-                        prs.append(pr['number'])
-    except:
-        print("failed", repos['message'])
+        for pr in gh.getall(url, key='items'):
+            prs.append(pr['number'])
+    except GitHubError as e:
+        print("failed", e)
     return prs
 
-# Change the labels on an issue from approval: done to approval: ready to merge
+# The PRs found to be ready, as (pr, approval time) tuples.  They are
+# moved together once all PRs are checked
 
-def movelabeldonetoready(issue):
-    url = api_url + "/issues/" + str(issue) + "/labels/approval:%20done"
-    res = requests.delete(url, headers=headers)
-    if (res.status_code != 200):
-        print("Error removing label", res.status_code, res.content)
-        return
-    url = api_url + "/issues/" + str(issue) + "/labels"
-    newlabel = {"labels": ["approval: ready to merge"]}
-    res = requests.post(url, data=json.dumps(newlabel), headers=headers)
-    if (res.status_code != 200):
-        print("Error adding label", res.status_code, res.content)
+tomove = []
+
+def movecandidates():
+    candidates = tomove[:]
+    del tomove[:]
+    if not candidates:
         return
-    newcomment = {"body":"This pull request is ready to merge"}
-    url = api_url + "/issues/" + str(issue) + "/comments"
-    res = requests.post(url, data=json.dumps(newcomment), headers=headers)
-    if (res.status_code != 201):
-        print("Error adding comment", res.status_code, res.content)
+    if not options.commit:
+        print("use --commit to actually change the labels")
         return
+    for pr, result in mover.moveall(candidates):
+        print("Moving issue ", pr, " to approval: ready to merge:", result)
 
-# Check through an issue and see if it's a candidate for moving
-
-def checkpr(pr):
-    url = api_url + "/issues/" + str(pr) + "/timeline?per_page=100&page=1"
-    res = requests.get(url, headers=headers)
-    repos = res.json()
-    while 'next' in res.links.keys():
-        res = requests.get(res.links['next']['url'], headers=headers)
-        repos.extend(res.json())
+# Check through an issue and see if it's a candidate for moving.  The
+# timeline events are fetched unless they're given in |events|, and are
+# applied on top of |state|, which is the state from earlier events if
+# we have it
 
-    comments = []
-    approvallabel = {}
-    readytomerge = 0
+def checkpr(pr, events=None, state=None):
+    if events is None:
+        url = api_url + "/issues/" + str(pr) + "/timeline?per_page=100&page=1"
+        try:
+            repos = gh.getall(url)
+        except GitHubError as e:
+            return str(e)
+    else:
+        repos = events
+    if state is None:
+        state = PRState()
 
     for event in repos:
         try:
-            if (event['event'] == "commented"):
-                comments.append(convertdate(event["updated_at"]))
-                if debug:
-                    print("debug: commented at ",
-                          convertdate(event["updated_at"]))
-            if (event['event'] == "committed"):
-                comments.append(convertdate(event["author"]["date"]))
-                if debug:
-                    print("debug: created at ",
-                          convertdate(event["author"]["date"]))
-            elif (event['event'] == "labeled"):
-                if debug:
-                    print("debug: labelled with ", event['label']['name'],
-                          "at", convertdate(event["created_at"]))
-                approvallabel[event['label']['name']] = convertdate(
-                    event["created_at"])
-            elif (event['event'] == "unlabeled"):
-                if (debug):
-                    print("debug: unlabelled with ", event['label']['name'],
-                          "at", convertdate(event["created_at"]))
-                if event['label'][
-                        'name'] in approvallabel:  # have to do this for if labels got renamed in the middle
-                    del approvallabel[event['label']['name']]
-            elif (event['event'] == "reviewed"
-                  and event['state'] == "approved"):
-                if debug:
-                    print("debug: approved at",
-                          convertdate(event['submitted_at']))
+            state.apply(event, debug)
         except:
             return (repos['message'])
 
-    if 'approval: ready to merge' in approvallabel:
-        return ("issue already has label approval: ready to merge")
+    approvallabel = state.labels
     if 'approval: done' not in approvallabel:
+        if 'approval: ready to merge' in approvallabel:
+            return ("issue already has label approval: ready to merge")
         return ("issue did not get label approval: done")
     approvedone = approvallabel['approval: done']
 
-    if max(comments) > approvedone:
+    # Both labels and our comment means our own move was interrupted.
+    # Without the comment, someone added the label by hand, and the
+    # usual checks apply
+    if 'approval: ready to merge' in approvallabel:
+        try:
+            moving = mover.commented(pr, approvedone)
+        except MoveError as e:
+            return str(e)
+        if moving:
+            tomove.append((pr, approvedone))
+            return ("issue has both labels, finishing the move to approval: ready to merge")
+
+    if state.lastcomment and state.lastcomment > approvedone:
         return ("issue had comments after approval: done label was given")
 
     now = datetime.now(timezone.utc)
     hourssinceapproval = (now - approvedone).total_seconds() / 3600
     if debug:
         print("Now: ", now)
-        print("Last comment: ", max(comments))
+        print("Last comment: ", state.lastcomment)
         print("Approved since: ", approvedone)
         print("hours since approval", hourssinceapproval)
 
@@ -135,11 +116,7 @@ def checkpr(pr):
         return ("not yet 24 hours since labelled approval:done hours:" +
                 str(int(hourssinceapproval)))
 
-    if (options.commit):
-        print("Moving issue ", pr, " to approval: ready to merge")
-        movelabeldonetoready(pr)
-    else:
-        print("use --commit to actually change the labels")
+    tomove.append((pr, approvedone))
     return (
         "this issue was candidate to move to approval: ready to merge hours:" +
         str(int(hourssinceapproval)))
@@ -150,6 +127,11 @@ parser = OptionParser()
 parser.add_option("-d","--debug",action="store_true",help="be noisy",dest="debug")
 parser.add_option("-t","--token",help="file containing github authentication token for example 'token 18asdjada...'",dest="token")
 parser.add_option("-c","--commit",action="store_true",help="actually change the labels",dest="commit")
+parser.add_option("-g","--graphql",action="store_true",help="fetch all timelines in a few batched GraphQL queries (needs --token)",dest="graphql")
+parser.add_option("-s","--state",help="SQLite file to keep the timeline state of PRs in between runs, so only new events are fetched (implies --graphql)",dest="state")
+parser.add_option("-l","--listen",type="int",help="after the first check, keep running and follow PRs through the webhook events received on this port (implies --graphql)",dest="listen")
+parser.add_option("--secret",help="file containing the webhook secret, for --listen",dest="secret")
+parser.add_option("-j","--jobs",type="int",default=4,help="number of PRs to check in parallel (default 4)",dest="jobs")
 (options, args) = parser.parse_args()
 if (options.token):
     fp = open(options.token, "r")
@@ -157,15 +139,57 @@ if (options.token):
 else:
     git_token = ""  # blank token is fine, but you can't change labels and you hit API rate limiting
 debug = options.debug
+if options.listen and not options.secret:
+    parser.error("--listen needs --secret")
+if options.state or options.listen:
+    options.graphql = True
+if options.graphql and not git_token:
+    parser.error("--graphql needs a token")
 # since timeline is a preview feature we have to enable access to it with an accept header
 headers = {
     "Accept": "application/vnd.github.mockingbird-preview",
     "Authorization": git_token
 }
+# one session shared by all threads, which also limits how many requests
+# are in flight so we stay clear of GitHub's secondary rate limits
+gh = GitHubSession(headers, parallel=max(options.jobs, 1), debug=debug)
+mover = LabelMover(gh, api_url, parallel=options.jobs, debug=debug)
 
 if debug:
     print("Getting list of PRs")
 prs = getpullrequests()
 print("There were", len(prs), "open PRs with approval:done ")
-for pr in prs:
-    print(pr, checkpr(pr))
+states = {}
+if options.state:
+    store = StateStore(options.state)
+    states = {pr: store.load(pr) for pr in prs}
+if options.graphql:
+    cursors = {pr: state.cursor for pr, state in states.items()}
+    timelines = ghgraphql.fetchtimelines(gh, repo, prs, cursors=cursors,
+                                         debug=debug)
+    for pr in prs:
+        states.setdefault(pr, PRState())
+    check = lambda pr: checkpr(pr, timelines[pr][0], states[pr])
+else:
+    check = checkpr
+with ThreadPoolExecutor(max_workers=max(options.jobs, 1)) as executor:
+    for pr, result in zip(prs, executor.map(check, prs)):
+        print(pr, result)
+movecandidates()
+if options.state:
+    for pr, state in states.items():
+        events, cursor = timelines[pr]
+        if isinstance(events, list):
+            state.cursor = cursor
+            store.save(pr, state)
+    store.keeponly(prs)
+
+if options.listen:
+    def checkandmove(pr, state):
+        result = checkpr(pr, [], state)
+        movecandidates()
+        return result
+    secret = open(options.secret, "rb").read().strip()
+    tracker = eventmode.ApprovalTracker(
+        states, checkandmove, store if options.state else None, debug=debug)
+    eventmode.serve(tracker, options.listen, secret)
@@ -0,0 +1,131 @@
+# requires python 3
+#
+# Move PRs from "approval: done" to "approval: ready to merge".
+#
+# All the PRs to move in a run are handed over at once and moved
+# concurrently, at most |parallel| at a time.  Each move starts by
+# looking at the PR's current labels and at the comments made since it
+# was approved, and only makes the changes that are still missing, so
+# running it again after a partial failure finishes the job instead of
+# repeating it.  Transient failures (server errors and connection
+# problems) are retried with backoff.
+#
+# The steps are ordered so that a PR is never left without either label:
+# first "approval: ready to merge" is added, then the comment is posted,
+# and "approval: done" is removed last.  A PR that has both labels and
+# the comment is therefore one whose move didn't finish.
+#
+import json
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+import requests
+
+donelabel = "approval: done"
+readylabel = "approval: ready to merge"
+readycomment = "This pull request is ready to merge"
+
+class MoveError(Exception):
+    pass
+
+class LabelMover:
+    def __init__(self, gh, api_url, parallel=4, retries=3, backoff=2,
+                 debug=False):
+        self.gh = gh
+        self.api_url = api_url
+        self.parallel = parallel
+        self.retries = retries
+        self.backoff = backoff
+        self.debug = debug
+
+    # Perform a request, retrying transient failures.  |ok| are the
+    # status codes that count as success.  A request that isn't
+    # idempotent may have gone through even though it failed, so it is
+    # only retried if |done|, when given, says it didn't; otherwise None
+    # is returned
+
+    def call(self, what, method, url, ok, done=None, **kwargs):
+        for attempt in range(self.retries + 1):
+            if attempt > 0 and done is not None and done():
+                return None
+            try:
+                res = self.gh.request(method, url, **kwargs)
+                if res.status_code in ok:
+                    return res
+                if res.status_code < 500:
+                    break
+                error = res.status_code
+            except requests.RequestException as e:
+                res = None
+                error = e
+            if attempt < self.retries:
+                if self.debug:
+                    print("debug:", what, "failed:", error, "retrying",
+                          file=sys.stderr)
+                time.sleep(self.backoff * 2 ** attempt)
+        if res is None:
+            raise MoveError("Error %s: %s" % (what, error))
+        raise MoveError("Error %s: %d %s" % (what, res.status_code,
+                                             res.content))
+
+    # Has the "ready to merge" comment been posted on |pr| since |since|?
+    # That is what tells a move in progress from a PR that someone gave
+    # both labels by hand
+
+    def commented(self, pr, since):
+        url = (self.api_url + "/issues/" + str(pr)
+               + "/comments?per_page=100&since="
+               + urllib.parse.quote(since.astimezone(timezone.utc)
+                                    .strftime("%Y-%m-%dT%H:%M:%SZ")))
+        res = self.call("getting comments", "GET", url, (200,))
+        return any(c['body'] == readycomment for c in res.json())
+
+    # Move one PR.  |since| is when it got the "approval: done" label.
+    # Returns a description of what was done
+
+    def move(self, pr, since):
+        issue = self.api_url + "/issues/" + str(pr)
+        res = self.call("getting labels", "GET", issue + "/labels", (200,))
+        labels = set(label['name'] for label in res.json())
+        done = []
+
+        # Without either label, the approval was taken back since the
+        # PR was checked
+        if donelabel not in labels and readylabel not in labels:
+            raise MoveError("Not moving: approval was withdrawn")
+
+        if readylabel not in labels:
+            self.call("adding label", "POST", issue + "/labels", (200,),
+                      data=json.dumps({"labels": [readylabel]}))
+            done.append("added label")
+
+        if not self.commented(pr, since):
+            self.call("adding comment", "POST", issue + "/comments", (201,),
+                      done=lambda: self.commented(pr, since),
+                      data=json.dumps({"body": readycomment}))
+            done.append("commented")
+
+        if donelabel in labels:
+            # 404 means someone else removed it in the meantime
+            self.call("removing label", "DELETE",
+                      issue + "/labels/" + urllib.parse.quote(donelabel),
+                      (200, 404))
+            done.append("removed label")
+
+        return ", ".join(done) if done else "nothing left to do"
+
+    def trymove(self, pr, since):
+        try:
+            return self.move(pr, since)
+        except MoveError as e:
+            return str(e)
+
+    # Move all of |candidates|, a list of (pr, since) tuples.  Returns a
+    # list of (pr, description) in the same order
+
+    def moveall(self, candidates):
+        with ThreadPoolExecutor(max_workers=max(self.parallel, 1)) as executor:
+            results = executor.map(lambda c: self.trymove(*c), candidates)
+            return [(c[0], r) for c, r in zip(candidates, results)]
@@ -0,0 +1,101 @@
+# requires python 3
+#
+# Approval state of a pull request, and a store to keep it between runs.
+#
+# PRState is what checkpr() needs to know about a PR, folded from its
+# timeline events: which labels it has and since when, and when the last
+# comment or commit was made.  Since the state is built incrementally,
+# it can be saved together with the cursor of the last timeline item seen,
+# and the next run only has to apply the events that came after it.
+#
+# Note that a comment that is edited later, without any new timeline
+# item, only updates the last comment time if the timeline is read in
+# full again.
+#
+import json
+import sqlite3
+from datetime import datetime
+
+def convertdate(date):
+    return datetime.strptime(date.replace('Z',"+0000"), "%Y-%m-%dT%H:%M:%S%z")
+
+class PRState:
+    def __init__(self, labels=None, lastcomment=None, cursor=None):
+        self.labels = labels or {}      # label name -> when it was added
+        self.lastcomment = lastcomment  # last comment or commit
+        self.cursor = cursor            # last timeline item seen
+
+    def comment(self, when):
+        if self.lastcomment is None or when > self.lastcomment:
+            self.lastcomment = when
+
+    def apply(self, event, debug=False):
+        if (event['event'] == "commented"):
+            self.comment(convertdate(event["updated_at"]))
+            if debug:
+                print("debug: commented at ",
+                      convertdate(event["updated_at"]))
+        if (event['event'] == "committed"):
+            self.comment(convertdate(event["author"]["date"]))
+            if debug:
+                print("debug: created at ",
+                      convertdate(event["author"]["date"]))
+        elif (event['event'] == "labeled"):
+            if debug:
+                print("debug: labelled with ", event['label']['name'],
+                      "at", convertdate(event["created_at"]))
+            self.labels[event['label']['name']] = convertdate(
+                event["created_at"])
+        elif (event['event'] == "unlabeled"):
+            if (debug):
+                print("debug: unlabelled with ", event['label']['name'],
+                      "at", convertdate(event["created_at"]))
+            if event['label'][
+                    'name'] in self.labels:  # have to do this for if labels got renamed in the middle
+                del self.labels[event['label']['name']]
+        elif (event['event'] == "reviewed"
+              and event['state'] == "approved"):
+            if debug:
+                print("debug: approved at",
+                      convertdate(event['submitted_at']))
+
+class StateStore:
+    def __init__(self, path):
+        # callers take care of serializing access from several threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS prs (
+                               number INTEGER PRIMARY KEY,
+                               cursor TEXT,
+                               labels TEXT NOT NULL,
+                               lastcomment TEXT)""")
+
+    def load(self, pr):
+        row = self.db.execute("SELECT cursor, labels, lastcomment FROM prs"
+                              " WHERE number = ?", (pr,)).fetchone()
+        if row is None:
+            return PRState()
+        cursor, labels, lastcomment = row
+        labels = {k: datetime.fromisoformat(v)
+                  for k, v in json.loads(labels).items()}
+        if lastcomment is not None:
+            lastcomment = datetime.fromisoformat(lastcomment)
+        return PRState(labels, lastcomment, cursor)
+
+    def save(self, pr, state):
+        labels = json.dumps({k: v.isoformat() for k, v in state.labels.items()})
+        lastcomment = state.lastcomment.isoformat() if state.lastcomment else None
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?)",
+                            (pr, state.cursor, labels, lastcomment))
+
+    def forget(self, pr):
+        with self.db:
+            self.db.execute("DELETE FROM prs WHERE number = ?", (pr,))
+
+    # Forget the PRs that aren't candidates any more
+
+    def keeponly(self, prs):
+        with self.db:
+            known = [r[0] for r in self.db.execute("SELECT number FROM prs")]
+            for pr in set(known) - set(prs):
+                self.db.execute("DELETE FROM prs WHERE number = ?", (pr,))
@@ -0,0 +1,62 @@
+# requires python 3
+#
+# A hashed timer wheel.
+#
+# Time is divided in ticks of |tick| seconds, and each timer lives in the
+# slot for its tick, modulo the number of slots.  Scheduling and
+# cancelling are O(1), and advancing the wheel only looks at the slots
+# of the ticks that passed.  Timers further away than one turn of the
+# wheel share a slot with nearer ones and simply stay there until their
+# own tick comes.
+#
+# Each key has at most one timer; scheduling it again moves it.
+#
+
+class TimerWheel:
+    def __init__(self, now, tick=60, slots=512):
+        self.tick = tick
+        self.slots = [{} for i in range(slots)]
+        self.deadlines = {}     # key -> tick
+        self.current = int(now // tick)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    # Make |key| due at time |when|.  Times that have already passed are
+    # due at the next advance().
+
+    def schedule(self, key, when):
+        self.cancel(key)
+        t = max(int(-(-when // self.tick)), self.current + 1)
+        self.deadlines[key] = t
+        self.slots[t % len(self.slots)][key] = t
+
+    def cancel(self, key):
+        t = self.deadlines.pop(key, None)
+        if t is not None:
+            del self.slots[t % len(self.slots)][key]
+
+    # Move the wheel to time |now|, and return the keys that became due
+
+    def advance(self, now):
+        target = int(now // self.tick)
+        if target <= self.current:
+            return []
+        n = len(self.slots)
+        if target - self.current >= n:
+            indexes = range(n)
+        else:
+            indexes = (t % n for t in range(self.current + 1, target + 1))
+        due = []
+        for i in indexes:
+            slot = self.slots[i]
+            for key, t in list(slot.items()):
+                if t <= target:
+                    del slot[key]
+                    del self.deadlines[key]
+                    due.append(key)
+        self.current = target
+        return due
@@ -0,0 +1,160 @@
+# Attribute commits to committers, OSS, companies under a CCLA and
+# individuals.
+#
+# The counts are kept per year in Counters, which add up: the counts of
+# several ranges of commits are merged by summing them, so the ranges can
+# be counted separately, in different processes, and merged at the end.
+#
+# The counters are:
+#
+#   found            commits by a known author
+#   notfound         commits by an unknown author, not trivial
+#   trivial          commits by an unknown author, marked "CLA: trivial"
+#   committers       commits by committers, OSS or not
+#   osscommitters    commits by OSS paid committers
+#   ossnoncommitters commits by OSS paid people who aren't committers
+#   committersccla   commits by committers under a CCLA
+#   ccla             commits by non-committers under a CCLA
+
+import hashlib
+import json
+import re
+from collections import Counter, defaultdict
+from commitlog import gitlog
+
+EMAIL = re.compile(r'<([^>]+)>')
+CLA_LINE = re.compile(r'^([^\s]+)\s+(\S)')
+
+def load_cla(path):
+    cla= {}
+    with open(path) as clafile:
+        for line in clafile:
+            if not line.startswith('#'):
+                m = CLA_LINE.match(line.strip())
+                if m:
+                    cla[m[1].lower()] = m[2]
+    return cla
+
+# The attribution rules, read from a JSON file (see attribution.json) with:
+#
+#   skip        commits whose author line contains any of these strings
+#               aren't counted at all
+#   rules       a list of rules, tried in order on the lower case email
+#               address of the author.  The first rule whose "email"
+#               strings are all in the address gives the author's
+#               "category" and "committer" flag
+#   committers  the committers, other than those matched by the rules
+#   company     the CLA type that means a company pays for the work
+#   trivial     the pattern that marks a commit as trivial, in the case
+#               folded commit message
+#
+# Authors that no rule matches are classified from the CLA database.
+class Rules:
+    def __init__(self, config):
+        self.skip = tuple(config.get('skip', []))
+        self.rules = [ (tuple(r['email']), r['category'],
+                        bool(r.get('committer', False)))
+                       for r in config.get('rules', []) ]
+        self.committers = frozenset(e.lower()
+                                    for e in config.get('committers', []))
+        self.company = config.get('company', 'C')
+        self.trivial = re.compile(config.get('trivial', r'cla:\s*trivial'))
+        # changes whenever the rules do
+        self.version = hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def skipped(self, author):
+        return any(s in author for s in self.skip)
+
+    # What is known about an author, from their lower case email address.
+    # |category| is one of:
+    #
+    #   oss      paid by OSS (with the default rules)
+    #   ossnon   paid by OSS, but not a committer (with the default rules)
+    #   cla      has a CLA, of type |cla|
+    #   unknown  has no CLA
+    #
+    # or whatever else the rules say, and |committer| tells if they are a
+    # committer.
+    def classify(self, email, cla):
+        for strings, category, committer in self.rules:
+            if all(s in email for s in strings):
+                return (category, None, committer)
+        if email not in cla:
+            return ('unknown', None, email in self.committers)
+        return ('cla', cla[email], email in self.committers)
+
+# Classifies authors from the CLA database |cla| (email -> CLA type) and
+# the attribution |rules|.  Each address is only classified once.
+class Authors:
+    def __init__(self, cla, rules):
+        self.cla = cla
+        self.rules = rules
+        self.known = {}
+
+    def classify(self, email):
+        result = self.known.get(email)
+        if result is None:
+            result = self.known[email] = self.rules.classify(email.lower(),
+                                                             self.cla)
+        return result
+
+# Count |commits|, classifying their authors with |authors|.  The commits
+# are counted in the year of their author date, unless |year| is given.
+# Returns a dictionary of year -> Counter, and a list of (sha, author,
+# message) of the commits whose author is unknown
+def count(commits, authors, year=None):
+    rules = authors.rules
+    counts = defaultdict(Counter)
+    notfound = []
+    for cid, author, date, rest_of_block in commits:
+        if rules.skipped(author):
+            continue
+        m = EMAIL.search(author)
+        if not m:
+            continue
+        c = counts[year or (date.year if date else None)]
+        category, clatype, committer = authors.classify(m[1])
+        if category == 'unknown':
+            if rules.trivial.search(rest_of_block.casefold()):
+                c['trivial'] += 1
+            else:
+                c['notfound'] += 1
+                notfound.append((cid, author, rest_of_block))
+            continue
+        c['found'] += 1
+        if category == 'ossnon':
+            c['ossnoncommitters'] += 1
+        if committer:
+            c['committers'] += 1
+            if category == 'oss':
+                c['osscommitters'] += 1
+        if category == 'cla' and rules.company in clatype:
+            if committer:
+                c['committersccla'] += 1
+            else:
+                c['ccla'] += 1
+    return dict(counts), notfound
+
+# Count the commits of "git log |gitargs|" in |repo|.  This is what each
+# process of the pool runs.
+def count_git(repo, gitargs, authors, year=None):
+    return count(gitlog(gitargs, repo), authors, year)
+
+# Merge the results of count()
+def merge(results):
+    counts = defaultdict(Counter)
+    notfound = []
+    for c, n in results:
+        for year, counter in c.items():
+            counts[year].update(counter)
+        notfound.extend(n)
+    return dict(counts), notfound
+
+def total(counts):
+    return sum(counts.values(), Counter())
@@ -0,0 +1,117 @@
+# A cache of author classifications and commit counts, kept between runs.
+#
+# The classification of an author only depends on the CLA database and on
+# the attribution rules, so the cache is keyed on both: the CLA database
+# by its modification time and size, and the rules by their contents.
+# While neither changes, authors that were seen before are classified
+# without reading the CLA database at all.  When either changes, the
+# whole cache is dropped, including the counts, since they were made with
+# the old classification.
+#
+# For the incremental mode, the cache also keeps the counts per year of
+# all the commits processed so far, and the last commit processed.  The
+# next run then only has to count the commits that came after it, and
+# add them to the stored counts.
+
+import os
+import sqlite3
+from collections import Counter, defaultdict
+from attribution import load_cla
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS authors (
+    email TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    cla TEXT,
+    committer INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counts (
+    year INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (year, name)
+);
+"""
+
+class AuthorCache:
+    def __init__(self, path, cladb, rules):
+        self.path = path
+        self.cladb = cladb
+        self.rules = rules
+        self.cla = None
+        self.db = None
+        self.known = None
+        st = os.stat(cladb)
+        self.version = '%d:%d:%s' % (st.st_mtime_ns, st.st_size,
+                                     rules.version)
+        db = self.connect()
+        with db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                db.execute("DELETE FROM authors")
+                db.execute("DELETE FROM counts")
+                db.execute("DELETE FROM meta")
+                db.execute("INSERT INTO meta VALUES ('version', ?)",
+                           (self.version,))
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, timeout=30)
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    # The connection stays behind when the cache is handed to another
+    # process, which opens its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['db'] = None
+        return state
+
+    def classify(self, email):
+        email = email.lower()
+        db = self.connect()
+        if self.known is None:
+            self.known = { e: (category, cla, bool(committer))
+                           for e, category, cla, committer
+                           in db.execute("SELECT * FROM authors") }
+        if email in self.known:
+            return self.known[email]
+        if self.cla is None:
+            self.cla = load_cla(self.cladb)
+        result = self.known[email] = self.rules.classify(email, self.cla)
+        with db:
+            db.execute("INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?)",
+                       (email, result[0], result[1], int(result[2])))
+        return result
+
+    # The last commit counted, or None
+    def last(self):
+        row = self.connect().execute(
+            "SELECT value FROM meta WHERE key = 'last'").fetchone()
+        return row[0] if row else None
+
+    # The stored counts, as a dictionary of year -> Counter
+    def counts(self):
+        counts = defaultdict(Counter)
+        for year, name, value in self.connect().execute(
+                "SELECT year, name, value FROM counts"):
+            counts[year or None][name] = value
+        return dict(counts)
+
+    # Add |counts| to the stored counts, and remember |last| as the last
+    # commit counted, all at once
+    def add(self, counts, last):
+        db = self.connect()
+        with db:
+            for year, counter in counts.items():
+                for name, value in counter.items():
+                    db.execute("INSERT INTO counts VALUES (?, ?, ?)"
+                               " ON CONFLICT (year, name)"
+                               " DO UPDATE SET value = value + excluded.value",
+                               (year or 0, name, value))
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('last', ?)",
+                       (last,))
@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+
+# Micro-benchmark of the commit attribution of
+# parse-commitlog-to-find-companies.py, on a synthetic log.
+#
+# A log of --commits commits (100000 by default) by --authors authors is
+# generated in the default git log format, and then counted:
+#
+#   parse    reading the commits with commitlog.parse()
+#   count    reading and attributing them with attribution.count()
+#   legacy   the way the script used to do it, with one re.findall()
+#            over the whole log and regular expressions for each commit
+#
+# Each is run --repeat times, and the best time is reported, in commits
+# per second.
+
+import os
+import random
+import re
+import time
+from argparse import ArgumentParser
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from commitlog import parse
+from attribution import Authors, Rules, count
+
+def synthetic_log(commits, authors, seed=0):
+    rnd = random.Random(seed)
+    people = []
+    cla = {}
+    for n in range(authors):
+        r = rnd.random()
+        if r < 0.1:
+            email = f'dev{n}@openssl.org'
+        elif r < 0.2:
+            email = f'daniel{n}@openssl.org' if r < 0.11 else f'person{n}@example.com'
+        else:
+            email = f'person{n}@company{n % 50}.example'
+        if r >= 0.1 and rnd.random() < 0.8:
+            cla[email] = rnd.choice('CI')
+        people.append(f'Person {n} <{email}>')
+    people.append('dependabot[bot] <49699333+dependabot[bot]@users.noreply.github.com>')
+    committers = [ e for e in cla if rnd.random() < 0.05 ]
+
+    lines = []
+    date = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    for n in range(commits):
+        date += timedelta(minutes=rnd.randint(1, 120))
+        lines.append(f'commit {rnd.getrandbits(160):040x}\n')
+        lines.append(f'Author: {rnd.choice(people)}\n')
+        lines.append(f'Date:   {date.strftime("%a %b %d %H:%M:%S %Y %z")}\n')
+        lines.append('\n')
+        lines.append(f'    Change number {n}\n')
+        lines.append('\n')
+        for i in range(rnd.randint(1, 8)):
+            lines.append('    Some explanation of what was changed and why it was\n')
+        lines.append('\n')
+        if rnd.random() < 0.05:
+            lines.append('    CLA: trivial\n')
+        lines.append(f'    Reviewed-by: Someone <someone{n % 7}@example.com>\n')
+        lines.append('\n')
+    return lines, cla, committers
+
+def legacy(text, cla, committers):
+    counts = 0
+    pattern = r"commit ([\w]+)\nAuthor: (.*?)\n([\s\S]*?)(?=^commit|\Z)"
+    for match in re.findall(pattern, text, flags=re.MULTILINE):
+        author = match[1].strip()
+        rest_of_block = match[2].strip()
+        cla_trivial = re.search(r"cla:\s*trivial", rest_of_block.casefold())
+        if "dependabot" in author:
+            continue
+        m = re.findall(r'<([^>]+)>',author)
+        if (len(m)>0):
+            if "openssl.org" in m[0].lower():
+                if "daniel" in m[0].lower():
+                    counts += 1
+            elif not m[0].lower() in cla:
+                counts += bool(cla_trivial)
+            elif m[0].lower() in committers and "C" in cla[m[0].lower()]:
+                counts += 1
+    return counts
+
+def best(repeat, f):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+parser = ArgumentParser()
+parser.add_argument('--commits', type=int, default=100000,
+                    help='the number of commits in the log (default: 100000)')
+parser.add_argument('--authors', type=int, default=2000,
+                    help='the number of different authors (default: 2000)')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='the number of runs of each benchmark (default: 3)')
+parser.add_argument('--rules', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attribution.json'),
+                    help='the attribution rules (default: attribution.json next to this script)')
+args = parser.parse_args()
+
+lines, cla, committers = synthetic_log(args.commits, args.authors)
+text = ''.join(lines)
+rules = Rules.load(args.rules)
+rules.committers = frozenset(committers)
+print(f'{args.commits} commits, {len(text) / 1e6:.1f} MB of log')
+
+benchmarks = [
+    ('parse', lambda: deque(parse(lines), maxlen=0)),
+    ('count', lambda: count(parse(lines), Authors(cla, rules))),
+    ('legacy', lambda: legacy(text, cla, set(committers))),
+]
+for name, f in benchmarks:
+    t = best(args.repeat, f)
+    print(f'{name:8} {t:8.3f}s {args.commits / t:12.0f} commits/s')
@@ -0,0 +1,97 @@
+# Read commits from git log output, one at a time.
+#
+# Both readers are generators yielding a Commit per commit, so a log of
+# any length is processed in constant memory.  parse() reads the default
+# "git log" output, for example from a saved log.txt, and gitlog() runs
+# git log itself and reads its output from a pipe.
+#
+# Merge commits are skipped, since they aren't anyone's work.
+
+import subprocess
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# |author| is "Name <email>", |date| the author date, and |body| the
+# commit message
+Commit = namedtuple('Commit', 'sha author date body')
+
+MONTHS = { m: n for n, m in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                        'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'),
+                                       1) }
+zones = {}
+
+# "Thu Jul 6 12:34:56 2023 +0200", the default git log date.  This is
+# what strptime() with '%a %b %d %H:%M:%S %Y %z' does, several times faster
+def gitdate(s):
+    _, month, day, hms, year, tz = s.split()
+    zone = zones.get(tz)
+    if zone is None:
+        offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[3:5]))
+        zone = zones[tz] = timezone(-offset if tz[0] == '-' else offset)
+    h, m, sec = hms.split(':')
+    return datetime(int(year), MONTHS[month], int(day), int(h), int(m), int(sec),
+                    tzinfo=zone)
+
+# Parse the default "git log" output, given as an iterable of lines
+def parse(lines):
+    sha = None
+    author = date = None
+    body = []
+    for line in lines:
+        if line.startswith('commit '):
+            if sha is not None and author is not None:
+                yield Commit(sha, author, date, '\n'.join(body).strip())
+            sha = line.split()[1]
+            author = date = None
+            body = []
+        elif sha is None:
+            continue
+        elif author is None:
+            if line.startswith('Author: '):
+                author = line[len('Author: '):].strip()
+            else:
+                # "Merge: ..."
+                sha = None
+        elif date is None and line.startswith('Date: '):
+            date = gitdate(line[len('Date: '):])
+        else:
+            body.append(line.rstrip('\n')[4:])
+    if sha is not None and author is not None:
+        yield Commit(sha, author, date, '\n'.join(body).strip())
+
+# Run "git log" in |repo| with the extra arguments |args| (revision range,
+# --since, --before, ...) and yield its commits as they come
+def gitlog(args=(), repo='.'):
+    cmd = [ 'git', '-C', repo, 'log', '-z', '--no-merges',
+            '--format=%H%n%aN <%aE>%n%aI%n%B', *args ]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8',
+                          errors='replace') as proc:
+        pending = ''
+        while True:
+            chunk = proc.stdout.read(65536)
+            if not chunk:
+                break
+            records = (pending + chunk).split('\0')
+            pending = records.pop()
+            for r in records:
+                yield record(r)
+        if pending.strip():
+            yield record(pending)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+# The SHA of |rev| in |repo|
+def revparse(rev='HEAD', repo='.'):
+    return subprocess.run([ 'git', '-C', repo, 'rev-parse', '--verify', rev ],
+                          stdout=subprocess.PIPE, encoding='utf-8',
+                          check=True).stdout.strip()
+
+# Is |ancestor| in the history of |rev| in |repo|?
+def isancestor(ancestor, rev='HEAD', repo='.'):
+    return subprocess.run([ 'git', '-C', repo, 'merge-base', '--is-ancestor',
+                            ancestor, rev ],
+                          stderr=subprocess.DEVNULL).returncode == 0
+
+def record(r):
+    sha, author, date, body = r.lstrip('\n').split('\n', 3)
+    return Commit(sha, author, datetime.fromisoformat(date), body.strip())
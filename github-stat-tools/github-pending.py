@@ -1,12 +1,21 @@
 #! /usr/bin/env python3
 
+import heapq
+import os
+import random
 import sys
-import subprocess
+import threading
+import time
 import requests
 import json
 import pprint
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from argparse import ArgumentParser
+from requests.adapters import HTTPAdapter
+from zabbixsender import ZabbixSender, ZabbixError
+import promexport
+from spool import Spool
 
 dryrun = False
 debug = False
@@ -14,58 +23,305 @@ now = datetime.now(timezone.utc)
 
 ### Helpers
 
-def search(host, q, headers):
+# The search API allows a number of requests per minute.  This token
+# bucket lets that many through in a burst, and then spaces them out.
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            t = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (t - self.last) * self.rate)
+            self.last = t
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+limiter = None
+
+def search(host, q, session):
     search_urls = {
         'github.com': 'https://api.github.com/search/issues'
     }
 
     url = search_urls[host] + '?q=' + '%20'.join(q)
     if debug: print(f'DEBUG[search]: {url=}', file=sys.stderr)
-    res = requests.get(url, headers=headers).json()
+    # The search API allows only a few requests per minute, so wait and
+    # retry when we hit the limit
+    for attempt in range(3):
+        if limiter: limiter.wait()
+        res = session.get(url)
+        if res.status_code not in (403, 429):
+            break
+        wait = res.headers.get('Retry-After')
+        if wait is None and res.headers.get('X-RateLimit-Remaining') == '0':
+            wait = int(res.headers.get('X-RateLimit-Reset', 0)) - time.time()
+        if wait is None:
+            break
+        wait = min(max(float(wait), 1), 120)
+        if debug: print(f'DEBUG[search]: rate limited, waiting {wait:.0f}s',
+                        file=sys.stderr)
+        time.sleep(wait)
+    res = res.json()
     if debug: print(f'DEBUG[search]: {res=}', file=sys.stderr)
     return res
 
+# A metric definition file is a JSON list of objects, each with:
+#
+#   key         the metric key, for example "openssl.openssl.prs.gap"
+#   query       the search query, as a list of terms
+#   backend     (optional) the backend to send the value to, instead of
+#               the one given with --backend
+#   interval    (optional) in daemon mode, how often to collect this
+#               metric, in seconds, instead of the --interval default
+#
+# The value of each metric is the total_count of its search.
+def load_metrics(path):
+    with open(path) as f:
+        metrics = json.load(f)
+    for m in metrics:
+        if 'key' not in m or 'query' not in m:
+            raise ValueError(f'{path}: metric without key or query: {m}')
+        if m.get('backend', backend) not in backends:
+            raise ValueError(f'{path}: {m["key"]}: unknown backend {m["backend"]}')
+    return metrics
+
+# Run the searches for all |metrics| concurrently, |jobs| at a time.  A
+# query that is used by several metrics is only searched once.  Returns
+# a list of (metric, count) tuples, where count is None if the search
+# failed.
+def collect(host, metrics, session, jobs):
+    def count(q):
+        try:
+            res = search(host, q, session)
+        except (requests.RequestException, ValueError) as e:
+            print(f'Search {" ".join(q)} failed: {e}', file=sys.stderr)
+            return None
+        if 'total_count' not in res:
+            print(f'Search {" ".join(q)} failed: {res.get("message")}',
+                  file=sys.stderr)
+            return None
+        return res['total_count']
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        searches = {}
+        for m in metrics:
+            q = tuple(m['query'])
+            if q not in searches:
+                searches[q] = executor.submit(count, q)
+        return [ (m, searches[tuple(m['query'])].result()) for m in metrics ]
+
+def report(host, server, results):
+    global now
+    now = datetime.now(timezone.utc)
+    for m, count in results:
+        if count is not None:
+            backends[m.get('backend', backend)](host, server, m['key'],
+                                                { 'metric': count })
+    for flush in flushers.values():
+        flush(server)
+
+# Daemon mode: keep running, and collect each metric every |interval|
+# seconds (or its own interval).  Each collection time is jittered by
+# up to 10% of the interval, so that metrics with the same interval
+# drift apart instead of all hitting the search API at the same moment.
+# Metrics that happen to be due together are collected in one go.
+def daemon(host, server, metrics, session, jobs, interval):
+    def jitter(i):
+        return random.uniform(-i / 10, i / 10)
+
+    queue = []
+    start = time.time()
+    for n, m in enumerate(metrics):
+        i = m.get('interval', interval)
+        heapq.heappush(queue, (start + random.uniform(0, i / 10), n))
+    while True:
+        due, n = queue[0]
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        batch = []
+        while queue and queue[0][0] <= time.time():
+            due, n = heapq.heappop(queue)
+            batch.append(metrics[n])
+            i = metrics[n].get('interval', interval)
+            heapq.heappush(queue, (max(due + i + jitter(i), time.time()), n))
+        if debug:
+            print(f'DEBUG[daemon]: collecting {[m["key"] for m in batch]}',
+                  file=sys.stderr)
+        try:
+            report(host, server, collect(host, batch, session, jobs))
+        except Exception as e:
+            print(f'Collection failed: {e}', file=sys.stderr)
+
 ### Result backends
 
 # Zabbix doesn't support much in terms of indexable <key:value>s alongside
 # the metric, like Prometheus or Loki do.  Instead, we feed all of them as
-# separate values in one input, with the hope that they all get the same
-# time stamp
+# separate values.  They are collected over the whole run and sent in one
+# request with the Zabbix sender protocol when the backend is flushed, so
+# they all get the same time stamp.
+#
+# With --spool, values that can't be sent are kept in a spool file with
+# their time stamp, and sent along with the next values once the server
+# is reachable again, in requests of at most |zabbix_chunk| values
+zabbix_batch = []
+zabbix_chunk = 250
+spool = None
+
 def backend_zabbix(host, server, basekey, values):
-    zabbix_command = ['zabbix_sender', '-z', server, '-i', '-']
-    zabbix_lines = [f'{host} {basekey}.{k} {v}' for k,v in values.items()]
-    zabbix_input = "\n".join(zabbix_lines) + "\n"
+    zabbix_batch.extend((host, f'{basekey}.{k}', v) for k,v in values.items())
+
+def flush_zabbix(server):
+    global zabbix_batch
+    items, zabbix_batch = zabbix_batch, []
+    if not items:
+        return
     if debug or dryrun:
         prefix = 'DEBUG[backend_zabbix]: ' if debug else ''
-        intro = 'would run this command:' if dryrun else 'running this command:'
-        for l in [ intro,
+        intro = 'would send this' if dryrun else 'sending this'
+        for l in [ f'{intro} to {server}:',
                    '',
-                   ' '.join([ *zabbix_command, '<<_____']),
-                   *zabbix_lines,
-                   '_____',
+                   *( f'{h} {k} {v}' for h, k, v in items ),
                    '' ]:
             print(f'{prefix}{l}', file=sys.stderr)
 
     if not dryrun:
-        subprocess.run(zabbix_command, input=zabbix_input, text=True);
+        clock = now.timestamp()
+        items = [ (h, k, v, clock) for h, k, v in items ]
+        sender = ZabbixSender(server)
+
+        # Send |items| in requests of at most |zabbix_chunk| values, and
+        # return how many of them the server answered for
+        def send_all(items):
+            for n in range(0, len(items), zabbix_chunk):
+                try:
+                    summary = sender.send(items[n:n + zabbix_chunk], clock)
+                except (OSError, ZabbixError) as e:
+                    print(f'Sending to Zabbix server {server} failed: {e}',
+                          file=sys.stderr)
+                    return n
+                # Values that the server refused would be refused again,
+                # so they aren't spooled
+                if debug or summary.get('failed', 0):
+                    print(f'Zabbix server {server}: processed: {summary.get("processed")};'
+                          f' failed: {summary.get("failed")}; total: {summary.get("total")}',
+                          file=sys.stderr)
+            return len(items)
+
+        # The spool is replayed oldest first, one file at a time, and a
+        # file is only dropped once the server has answered for it.  If
+        # the server stops answering, the new values are appended to the
+        # spool, behind what's still in it
+        if spool:
+            for path, spooled in spool.pending():
+                if debug:
+                    print(f'DEBUG[backend_zabbix]: replaying {len(spooled)} spooled values from {path}',
+                          file=sys.stderr)
+                n = send_all(spooled)
+                spool.done(path, spooled[n:])
+                if n < len(spooled):
+                    break
+            else:
+                items = items[send_all(items):]
+            if items:
+                spool.append(items)
+                print(f'Spooled {len(items)} values to {spool.path}',
+                      file=sys.stderr)
+        else:
+            send_all(items)
 
 # Echoing is done in a way that's similar to Prometheus / Loki input.
 # The "metric" value is treated specially, so it becomes the actual sole
 # value, while the rest of the values are indexing label values.
-def backend_echo(host, server, basekey, values):
+def format_echo(host, server, basekey, values):
     t = now.isoformat()
     s = f'{basekey}' + '{' + ', '.join(
         [ f'host="{host}"',
           f'server={server}',
           *( f'{k}="{v}"' for k,v in values.items() if k != 'metric' ) ]
     ) + '}'
-    print(f'{t}: {s} {values["metric"]}')
+    return f'{t}: {s} {values["metric"]}'
+
+def backend_echo(host, server, basekey, values):
+    print(format_echo(host, server, basekey, values))
+
+# The file backend writes the same lines as the echo backend, appending
+# them to the --output file.  The lines of a whole collection are written
+# at once, when the backend is flushed
+output_file = None
+file_batch = []
+
+def backend_file(host, server, basekey, values):
+    file_batch.append(format_echo(host, server, basekey, values))
+
+def flush_file(server):
+    global file_batch
+    lines, file_batch = file_batch, []
+    if not lines:
+        return
+    if debug or dryrun:
+        intro = 'would append' if dryrun else 'appending'
+        print(f'DEBUG[backend_file]: {intro} {len(lines)} lines to {output_file}',
+              file=sys.stderr)
+    if not dryrun:
+        try:
+            with open(output_file, 'a') as f:
+                f.write(''.join(l + '\n' for l in lines))
+        except OSError as e:
+            print(f'Appending to {output_file} failed: {e}', file=sys.stderr)
+
+# The prometheus backend keeps the latest value of each metric, with the
+# same labels as the echo backend.  When the backend is flushed, they are
+# pushed to the --pushgateway if one is given.  Otherwise, with --listen,
+# they are served for Prometheus to scrape, and otherwise they are printed
+# in the Prometheus text format
+prometheus = promexport.Registry()
+pushgateway = None
+listen = None
+
+def backend_prometheus(host, server, basekey, values):
+    prometheus.add(host, server, basekey, values)
+
+def flush_prometheus(server):
+    if not prometheus.series:
+        return
+    if pushgateway:
+        if debug or dryrun:
+            intro = 'would push' if dryrun else 'pushing'
+            print(f'DEBUG[backend_prometheus]: {intro} this to {pushgateway}:',
+                  file=sys.stderr)
+            print(prometheus.render(), file=sys.stderr)
+        if not dryrun:
+            try:
+                promexport.push(prometheus, pushgateway, 'github-pending')
+            except OSError as e:
+                print(f'Pushing to {pushgateway} failed: {e}', file=sys.stderr)
+    elif listen is None:
+        print(prometheus.render(), end='')
 
 ### Info databases
 
 backends = {
     'zabbix': backend_zabbix,
     'echo': backend_echo,
+    'file': backend_file,
+    'prometheus': backend_prometheus,
+}
+
+# Backends that batch their values, and need to be flushed at the end of
+# each collection
+flushers = {
+    'zabbix': flush_zabbix,
+    'file': flush_file,
+    'prometheus': flush_prometheus,
 }
 
 ### Main
@@ -74,6 +330,10 @@ backends = {
 host = 'github.com'
 backend = 'echo'
 server = 'localhost'
+metrics_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'metrics.json')
+jobs = 4
+interval = 300
 # blank token is fine, but you may hit API rate limiting
 git_token = ''
 
@@ -87,8 +347,38 @@ parser.add_argument('--host',
                     help='the github host to check',
                     dest='host')
 parser.add_argument('--server', '-s',
-                    help='Metrics server (Zabbix) host or IP address',
+                    help='Metrics server (Zabbix) host or IP address, optionally with :port',
                     dest='server')
+parser.add_argument('--spool',
+                    help='file to keep the values the zabbix backend couldn\'t send in, until they can be',
+                    dest='spool')
+parser.add_argument('--spool-size', type=int, default=10,
+                    help='the size in MiB at which the spool file is rotated; up to 3 rotations are kept (default: 10)',
+                    dest='spool_size')
+parser.add_argument('--output', '-o',
+                    help='the file the file backend appends to',
+                    dest='output')
+parser.add_argument('--pushgateway',
+                    help='Prometheus Pushgateway URL the prometheus backend pushes to',
+                    dest='pushgateway')
+parser.add_argument('--listen', '-l', type=int,
+                    help='in daemon mode, the port to serve the prometheus backend\'s /metrics on',
+                    dest='listen')
+parser.add_argument('--metrics', '-m',
+                    help=f'the metric definition file (default: {metrics_file})',
+                    dest='metrics')
+parser.add_argument('--jobs', '-j', type=int,
+                    help=f'the number of searches to run in parallel (default: {jobs})',
+                    dest='jobs')
+parser.add_argument('--daemon', '-D', action='store_true',
+                    help='keep running and collect the metrics periodically',
+                    dest='daemon')
+parser.add_argument('--interval', '-i', type=int,
+                    help=f'in daemon mode, the default collection interval in seconds (default: {interval})',
+                    dest='interval')
+parser.add_argument('--search-rate', type=int,
+                    help='the maximum number of searches per minute (default: 30 with a token, 10 without)',
+                    dest='search_rate')
 parser.add_argument('--token', '-t',
                     help='file containing github authentication token for example "18asdjada..."',
                     dest='token')
@@ -105,27 +395,46 @@ if args.host:
     host = args.host
 if args.server:
     server = args.server
+if args.metrics:
+    metrics_file = args.metrics
+if args.jobs:
+    jobs = max(args.jobs, 1)
+if args.interval:
+    interval = args.interval
 if args.token:
     fp = open(args.token, 'r')
     git_token = fp.readline().strip('\n')
+if args.spool:
+    spool = Spool(args.spool, args.spool_size * 1024 * 1024)
+output_file = args.output
+pushgateway = args.pushgateway
+listen = args.listen
 debug = args.debug
 dryrun = args.dryrun
+limiter = RateLimiter(args.search_rate or (30 if git_token else 10))
 
 # Do stuff
-headers = {
+metrics = load_metrics(metrics_file)
+used = set(m.get('backend', backend) for m in metrics)
+if 'file' in used and not output_file:
+    parser.error('the file backend needs --output')
+if listen is not None and not args.daemon:
+    parser.error('--listen only makes sense with --daemon')
+
+# One session for all searches, so connections are reused
+session = requests.Session()
+session.headers.update({
     'Accept': 'application/vnd.github+json',
     'Authorization': git_token,
-}
-
-
-open_issues = search(
-    host, [ 'repo:openssl/openssl', 'type:issue', 'state:open' ], headers
-)
-open_pulls = search(
-    host, [ 'repo:openssl/openssl', 'type:pr', 'state:open' ], headers
-)
+})
+session.mount('https://', HTTPAdapter(pool_maxsize=jobs))
 
-backends[backend](host, server, 'openssl.openssl.issues.gap',
-                  { 'metric': open_issues['total_count'] })
-backends[backend](host, server, 'openssl.openssl.prs.gap',
-                  { 'metric': open_pulls['total_count'] })
+if args.daemon:
+    if listen is not None:
+        promexport.serve(prometheus, listen)
+    try:
+        daemon(host, server, metrics, session, jobs, interval)
+    except KeyboardInterrupt:
+        pass
+else:
+    report(host, server, collect(host, metrics, session, jobs))
@@ -1,5 +1,14 @@
+#! /usr/bin/env python3
+
+import os
 import sys
-import re
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from itertools import chain
+from commitlog import isancestor, parse, revparse
+from attribution import Authors, Rules, count, count_git, load_cla, merge, total
+from authorcache import AuthorCache
 
 # Script created for OpenSSL commit parsing so we can get an
 # idea how many commits come from paid OpenSSL resources,
@@ -7,94 +16,149 @@ import re
 # because they have a CCLA) and other/individuals.
 
 # git log --since="6 Jul, 2022" --before="7 Jul, 2023" > log.txt
+#
+# or let the script run git log itself:
+#
+# ./parse-commitlog-to-find-companies.py --git ../../openssl --since="6 Jul, 2022" --before="7 Jul, 2023"
+#
+# With --years, there's a breakdown for each year, and with --git each
+# year is counted by its own process.  The years go by author date in a
+# saved log, and by commit date with --git, like git log --since does:
+#
+# ./parse-commitlog-to-find-companies.py --git ../../openssl --years 2015-2023
 
-# Committers who are not OSS
-committers = {"david.von.oheimb@siemens.com",
-              "matthias.st.pierre@ncp-e.com",
-              "shane.lontis@oracle.com",
-              "bernd.edlinger@hotmail.de",
-              "tshort@akamai.com",
-              "beldmit@gmail.com",
-              "kurt@roeckx.be",
-              "nic.tuv@gmail.com",
-              "kaishen.yy@antfin.com",
-              "openssl-users@dukhovni.org",
-              "tom.cosgrove@arm.com"}
-# We know who is in OSS because they commmit with openssl.org
-# email address, and no one not paid by OSS does that in the data
-# sample.
-
-cla= {}
-with open("../data/cladb.txt") as clafile:
-    for line in clafile:
-        if not line.startswith('#'):
-            m = re.findall(r'^([^\s]+)\s+(\S)',line.strip())
-            if (len(m) >0):
-                cla[m[0][0].lower()] = m[0][1]
+# Who counts as what is set in attribution.json (see --rules): the
+# committers who are not OSS, and the rules that tell who is in OSS.  We
+# know who is in OSS because they commmit with openssl.org email address,
+# and no one not paid by OSS does that in the data sample.
 
-commitsfound = 0
-commitsccla = 0
-commitscommitters = 0
-commitscommittersccla = 0
-commitsnotfound = 0
-commitsosscommitters = 0
-commitsossnoncommitters = 0
-committrivial = 0
+def sankey(c):
+    print (f"Found {c['found']+c['notfound']} commits")
+    print ("Paste below into https://sankeymatic.com/build/\n")
+    print (f"Commits by Committers [{c['committers']}] All Commits")
+    print (f"Commits by Non-Committers [{c['found']-c['committers']+c['notfound']}] All Commits")
+    print (f"OSS Paid Commits [{c['osscommitters']}] Commits by Committers")
+    if (c['ossnoncommitters'] > 0):
+        print (f"OSS Paid Commits [{c['ossnoncommitters']}] Commits by Non-Committers")
+    print (f"Company Paid Commits [{c['committersccla']}] Commits by Committers")
+    print (f"Individuals Commits [{c['committers']-c['osscommitters']-c['committersccla']}] Commits by Committers")
+    print (f"Company Paid Commits [{c['ccla']}] Commits by Non-Committers")
+    print (f"Individuals Commits [{c['found']-c['ossnoncommitters']-c['committers']-c['ccla']}] Commits by Non-Committers")
+    if (c['notfound'] > 0):
+        print (f"Unknown [{c['notfound']}] Non-Committers")
+    print (f"Trivial Commits [{c['trivial']}] All Commits")
 
-with open('log.txt', 'r') as file:
-    text = file.read()
+# "2015-2023" or "2023"
+def years(s):
+    first, _, last = s.partition('-')
+    return range(int(first), int(last or first) + 1)
 
-pattern = r"commit ([\w]+)\nAuthor: (.*?)\n([\s\S]*?)(?=^commit|\Z)"
-matches = re.findall(pattern, text, flags=re.MULTILINE)
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('log', nargs='?', default='log.txt',
+                        help='the saved git log output, "-" for stdin (default: log.txt)')
+    parser.add_argument('--git', metavar='REPO',
+                        help='run git log in REPO instead of reading a saved log')
+    parser.add_argument('--since',
+                        help='with --git, only commits since this date')
+    parser.add_argument('--before',
+                        help='with --git, only commits before this date')
+    parser.add_argument('--years', type=years, metavar='FIRST-LAST',
+                        help='break the counts down by year, for these years')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='with --git and --years, the number of years counted in parallel (default: number of CPUs)')
+    parser.add_argument('--cladb', default='../data/cladb.txt',
+                        help='the CLA database (default: ../data/cladb.txt)')
+    parser.add_argument('--rules', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attribution.json'),
+                        help='the attribution rules (default: attribution.json next to this script)')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='keep the author classifications in FILE between runs')
+    parser.add_argument('--incremental', action='store_true',
+                        help='with --cache, only count the commits made since the last run, and add them to the counts kept in the cache')
+    args = parser.parse_args()
+    if args.incremental and not args.cache:
+        parser.error('--incremental needs --cache')
+    if args.incremental and (args.since or args.before):
+        parser.error('--incremental counts from the last run, not with --since or --before')
+    if args.years and (args.since or args.before):
+        parser.error('--years sets the dates itself, not with --since or --before')
 
-for match in matches:
-    cid = match[0]
-    author = match[1].strip()
-    rest_of_block = match[2].strip()
-    cla_trivial = re.search(r"cla:\s*trivial", rest_of_block.casefold())
+    rules = Rules.load(args.rules)
+    if args.cache:
+        authors = AuthorCache(args.cache, args.cladb, rules)
+    else:
+        authors = Authors(load_cla(args.cladb), rules)
 
-    if "dependabot" in author:
-        continue
-    m = re.findall(r'<([^>]+)>',author)
-    if (len(m)>0):
-        if "openssl.org" in m[0].lower():
-            # Anyone who was paid OpenSSL but not a committer
-            if "daniel" in m[0].lower():
-                commitsossnoncommitters += 1
-            else:
-                commitsosscommitters += 1
-                commitscommitters+= 1
-            commitsfound += 1
-        elif not m[0].lower() in cla:
-            if cla_trivial:
-                committrivial += 1
-            else:
-                commitsnotfound += 1
-                print ("Not Found", cid, author,rest_of_block)
+    if args.incremental:
+        # The commits since the last one counted, newest first.  The
+        # years go by author date
+        last = authors.last()
+        if args.git:
+            head = revparse('HEAD', args.git)
+            if last and not isancestor(last, head, args.git):
+                sys.exit(f'The last commit counted, {last}, is not in the history of HEAD any more.'
+                         ' Start over with a new --cache.')
+            new, notfound = count_git(
+                args.git, [ f'{last}..{head}' if last else head ], authors)
         else:
-            commitsfound += 1
-            if m[0].lower() in committers:
-                commitscommitters+= 1
-            if ("C" in cla[m[0].lower()]):
-                if m[0].lower() in committers:
-                    commitscommittersccla += 1
-                else:
-                    commitsccla += 1
+            # Counting stops at the last commit counted, which has to be
+            # found, or the whole log would be counted again
+            reached = []
+            def since(commits):
+                for c in commits:
+                    if c.sha == last:
+                        reached.append(c)
+                        return
+                    yield c
+            commits = parse(sys.stdin if args.log == '-' else open(args.log, 'r'))
+            first = next(commits, None)
+            head = first.sha if first else last
+            new, notfound = count(since(chain([ first ] if first else [],
+                                              commits)),
+                                  authors)
+            if last and not reached:
+                sys.exit(f'The last commit counted, {last}, is not in {args.log}.'
+                         ' Start over with a new --cache.')
+        authors.add(new, head)
+        counts = authors.counts()
+    elif args.git and args.years:
+        # One shard per year, the years are separate git log runs.  Both
+        # --since and --before include the time given, and git dates go
+        # by the second, so each year ends on the last second before the
+        # next one starts
+        with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            counts, notfound = merge(executor.map(
+                count_git,
+                [ args.git ] * len(args.years),
+                [ [ f'--since={y}-01-01T00:00:00', f'--before={y}-12-31T23:59:59' ]
+                  for y in args.years ],
+                [ authors ] * len(args.years),
+                args.years))
+    elif args.git:
+        gitargs = []
+        if args.since:
+            gitargs.append(f'--since={args.since}')
+        if args.before:
+            gitargs.append(f'--before={args.before}')
+        counts, notfound = count_git(args.git, gitargs, authors)
+    else:
+        if args.log == '-':
+            commits = parse(sys.stdin)
+        else:
+            commits = parse(open(args.log, 'r'))
+        counts, notfound = count(commits, authors)
+
+    for cid, author, rest_of_block in notfound:
+        print ("Not Found", cid, author,rest_of_block)
 
-print (f"Found {commitsfound+commitsnotfound} commits")
-print ("Paste below into https://sankeymatic.com/build/\n")
-print (f"Commits by Committers [{commitscommitters}] All Commits")
-print (f"Commits by Non-Committers [{commitsfound-commitscommitters+commitsnotfound}] All Commits")
-print (f"OSS Paid Commits [{commitsosscommitters}] Commits by Committers")
-if (commitsossnoncommitters > 0):
-    print (f"OSS Paid Commits [{commitsossnoncommitters}] Commits by Non-Committers")
-print (f"Company Paid Commits [{commitscommittersccla}] Commits by Committers")
-print (f"Individuals Commits [{commitscommitters-commitsosscommitters-commitscommittersccla}] Commits by Committers")
-print (f"Company Paid Commits [{commitsccla}] Commits by Non-Committers")
-print (f"Individuals Commits [{commitsfound-commitsossnoncommitters-commitscommitters-commitsccla}] Commits by Non-Committers")
-if (commitsnotfound > 0):
-    print (f"Unknown [{commitsnotfound}] Non-Committers")
-print (f"Trivial Commits [{committrivial}] All Commits")
+    if args.years:
+        for y in args.years:
+            print (f"\n== {y} ==")
+            sankey(counts.get(y, Counter()))
+        print ("\n== All years ==")
+        sankey(total({ y: c for y, c in counts.items() if y in args.years }))
+    else:
+        sankey(total(counts))
 
 # Use sankeyMATIC
 #
@@ -0,0 +1,88 @@
+# Prometheus output for the metric collectors.
+#
+# The samples are kept in a registry holding the latest value of each
+# series.  The registry can be rendered in the Prometheus text exposition
+# format or in the OpenMetrics format, served over HTTP for Prometheus to
+# scrape, or pushed to a Pushgateway.
+#
+# Series follow the same convention as the "echo" backend: the "metric"
+# value is the sample value, and every other value is a label, alongside
+# the host and server labels.
+
+import re
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# "openssl.openssl.prs.gap" -> "openssl_openssl_prs_gap"
+def metric_name(key):
+    name = re.sub(r'[^a-zA-Z0-9_:]', '_', key)
+    return '_' + name if name[:1].isdigit() else name
+
+def label_value(v):
+    return str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+class Registry:
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def add(self, host, server, basekey, values):
+        labels = (('host', host), ('server', server),
+                  *sorted((metric_name(k), str(v))
+                          for k, v in values.items() if k != 'metric'))
+        with self.lock:
+            self.series[(metric_name(basekey), labels)] = values['metric']
+
+    def render(self, openmetrics=False):
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = []
+        last = None
+        for (name, labels), value in series:
+            if name != last:
+                lines.append(f'# TYPE {name} gauge')
+                last = name
+            l = ','.join(f'{k}="{label_value(v)}"' for k, v in labels)
+            lines.append(f'{name}{{{l}}} {value}')
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+# Serve |registry| on http://...:|port|/metrics, from a background thread
+def serve(registry, port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if urllib.parse.urlsplit(self.path).path != '/metrics':
+                self.send_error(404)
+                return
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body = registry.render(openmetrics).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+# Push |registry| to the Pushgateway at |url|, replacing what was pushed
+# before for |job|
+def push(registry, url, job):
+    req = urllib.request.Request(
+        url.rstrip('/') + '/metrics/job/' + urllib.parse.quote(job, safe=''),
+        data=registry.render().encode('utf-8'),
+        headers={ 'Content-Type': PROMETHEUS_TYPE },
+        method='PUT')
+    with urllib.request.urlopen(req, timeout=30) as res:
+        res.read()
@@ -0,0 +1,84 @@
+# A spool on disk for values that couldn't be sent.
+#
+# Values are appended to the spool file as JSON lines, each with the time
+# stamp it was collected at, so that they keep it when they are finally
+# sent.  When the spool file grows over |max_size| bytes, it's rotated:
+# FILE becomes FILE.1, FILE.1 becomes FILE.2 and so on, and the oldest
+# file beyond |keep| rotations is dropped.  The spool therefore never
+# takes more than about |max_size| * (|keep| + 1) bytes, and what's
+# dropped in a long outage is the oldest values.
+
+import json
+import os
+import sys
+
+class Spool:
+    def __init__(self, path, max_size=10 * 1024 * 1024, keep=3):
+        self.path = path
+        self.max_size = max_size
+        self.keep = keep
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def files(self):
+        # oldest first
+        return [ p for p in [ *( f'{self.path}.{n}'
+                                 for n in range(self.keep, 0, -1) ),
+                              self.path ]
+                 if os.path.exists(p) ]
+
+    def rotate(self):
+        oldest = f'{self.path}.{self.keep}'
+        if os.path.exists(oldest):
+            print(f'Spool {self.path}: dropping {oldest}', file=sys.stderr)
+            os.remove(oldest)
+        for n in range(self.keep - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{n}'):
+                os.rename(f'{self.path}.{n}', f'{self.path}.{n + 1}')
+        if self.keep > 0:
+            os.rename(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    # Append |items|, a list of (host, key, value, clock) tuples
+    def append(self, items):
+        if not items:
+            return
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(list(i)) + '\n' for i in items))
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.getsize(self.path) > self.max_size:
+            self.rotate()
+
+    # The spooled items of |path|
+    def read(self, path):
+        items = []
+        with open(path) as f:
+            for l in f:
+                try:
+                    items.append(tuple(json.loads(l)))
+                except ValueError:
+                    # a line cut short by a crash
+                    pass
+        return items
+
+    # The spooled items, one file at a time, as (path, items), oldest
+    # first.  Each file is to be handed back to done() once the server has
+    # answered for its items, so that nothing is lost if sending stops
+    # half way
+    def pending(self):
+        for p in self.files():
+            yield p, self.read(p)
+
+    # The items of |path| were sent, except |rest|, which stay in it.  The
+    # rest is written aside first, so a crash doesn't lose it
+    def done(self, path, rest=()):
+        if not rest:
+            os.remove(path)
+            return
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(''.join(json.dumps(list(i)) + '\n' for i in rest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+
+# The Zabbix sender protocol, spoken directly instead of through the
+# zabbix_sender binary.
+#
+# A request is a "ZBXD\x01" header, the length of the payload as an 8 byte
+# little endian number, and a JSON payload listing the values.  The server
+# replies in the same framing, with a summary of how many values were
+# processed and how many failed.  See
+# https://www.zabbix.com/documentation/current/en/manual/appendix/protocols/zabbix_sender
+#
+# Run this file with --listen to get a stand-in trapper that prints what it
+# receives and accepts everything, to test against without a Zabbix server.
+
+import json
+import re
+import socket
+import struct
+import sys
+import time
+
+HEADER = b'ZBXD\x01'
+DEFAULT_PORT = 10051
+
+class ZabbixError(Exception):
+    pass
+
+def pack(obj):
+    payload = json.dumps(obj).encode('utf-8')
+    return HEADER + struct.pack('<Q', len(payload)) + payload
+
+def recv_exactly(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ZabbixError('connection closed by peer')
+        data += chunk
+    return data
+
+def unpack(sock):
+    header = recv_exactly(sock, len(HEADER) + 8)
+    if header[:len(HEADER)] != HEADER:
+        raise ZabbixError(f'bad response header {header!r}')
+    length, = struct.unpack('<Q', header[len(HEADER):])
+    return json.loads(recv_exactly(sock, length))
+
+# "processed: 2; failed: 0; total: 2; seconds spent: 0.000055"
+def parse_info(info):
+    return { k.strip(): float(v) if '.' in v else int(v)
+             for k, v in re.findall(r'([a-z ]+):\s*([0-9.]+)', info) }
+
+class ZabbixSender:
+    def __init__(self, server, port=DEFAULT_PORT, timeout=10):
+        if ':' in server:
+            server, port = server.rsplit(':', 1)
+        self.address = (server, int(port))
+        self.timeout = timeout
+
+    # Send |items|, a list of (host, key, value) tuples, in one request,
+    # all with the timestamp |clock| (default: now).  An item can also be
+    # a (host, key, value, clock) tuple, to keep its own timestamp.
+    # Returns the server's summary as a dictionary with at least
+    # 'processed', 'failed' and 'total'.
+    def send(self, items, clock=None):
+        if clock is None:
+            clock = time.time()
+
+        def timestamp(c):
+            return { 'clock': int(c), 'ns': int((c % 1) * 1e9) }
+
+        request = pack({
+            'request': 'sender data',
+            'data': [ { 'host': i[0], 'key': i[1], 'value': str(i[2]),
+                        **timestamp(i[3] if len(i) > 3 else clock) }
+                      for i in items ],
+            **timestamp(clock),
+        })
+        # The trapper answers one request per connection, so all values
+        # go in one request to need only one connection
+        with socket.create_connection(self.address, self.timeout) as sock:
+            sock.sendall(request)
+            response = unpack(sock)
+        if response.get('response') != 'success':
+            raise ZabbixError(f'server replied {response}')
+        return parse_info(response.get('info', ''))
+
+### Stand-in trapper, for testing
+
+def serve(port):
+    srv = socket.create_server(('', port))
+    print(f'Stand-in Zabbix trapper listening on port {port}', file=sys.stderr)
+    while True:
+        conn, peer = srv.accept()
+        with conn:
+            try:
+                request = unpack(conn)
+            except (OSError, ZabbixError, ValueError) as e:
+                print(f'{peer}: {e}', file=sys.stderr)
+                continue
+            data = request.get('data', [])
+            for d in data:
+                print(f'{d.get("clock")} {d.get("host")} {d.get("key")} {d.get("value")}')
+            sys.stdout.flush()
+            conn.sendall(pack({
+                'response': 'success',
+                'info': f'processed: {len(data)}; failed: 0; total: {len(data)}; seconds spent: 0.000001',
+            }))
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Stand-in Zabbix trapper')
+    parser.add_argument('--listen', '-l', type=int, default=DEFAULT_PORT,
+                        help=f'port to listen on (default: {DEFAULT_PORT})')
+    args = parser.parse_args()
+    try:
+        serve(args.listen)
+    except KeyboardInterrupt:
+        pass
@@ -1,4 +1,4 @@
 #!/bin/bash
 echo "Creating working directory in /opt/openssl/tests and copying necesary files."
-mkdir -p /opt/openssl/tests && cp -r build perftest /opt/openssl/tests
+mkdir -p /opt/openssl/tests && cp -r build perftest /opt/openssl/tests && cp ../github-stat-tools/zabbixsender.py /opt/openssl/tests/perftest
 [ $? -eq 0 ] && { echo "PASSED"; exit 0; } || { echo "FAILED"; exit 1; }
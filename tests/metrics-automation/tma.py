@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 
 # pip3 install pyzabbix
-import sys, argparse, re, os
+import sys, argparse, re, os, json, time, atexit
 from pyzabbix import ZabbixAPI, ZabbixAPIException
 # disabling https warnings beacuse the internal IP address is used
 # and the certificate of public IP won't match then and it will raise an error
@@ -15,6 +15,15 @@ ZTIMEOUT = 5.0
 ZUSER = ""
 ZPASSWORD = ""
 ZTOKEN = ""
+# session cache for user and password authentication, empty to disable it
+ZSESSION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "tma", "session.json")
+# how long a cached session is used before logging in again [s]
+ZSESSION_TTL = 900.0
+# manifest mode
+DEFAULT_HOSTGROUP = "Applications"
+ITEM_DEFAULTS = {"value_type": 0, "history": "365d", "trends": "365d", "units": ""}
+# items created per item.create call
+BATCH_SIZE = 100
 
 # config file generator
 def mkconfig(config_file=DEFAULT_CONFIG_FILE):
@@ -29,11 +38,190 @@ ZUSER = CHANGE_ME
 ZPASSWORD = CHANGE_ME
 # Zabbix user's token
 #ZTOKEN = CHANGE_ME
+# Where the session of the user is kept between runs, to save logging in every time.
+# Leave it empty to log in and out on every run.
+#ZSESSION_CACHE = ~/.cache/tma/session.json
+# How long the cached session is used before logging in again [s]
+#ZSESSION_TTL = 900
 """
     print(f"Generating config file: {DEFAULT_CONFIG_FILE}")
     with open(DEFAULT_CONFIG_FILE, 'w') as f:
         f.write(config_data)
 
+# session cache
+#   The session ID of the last user and password login is kept in the file ZSESSION_CACHE, readable
+#   by the user only, with the server URL and the user name it is for, and an expiry time.  A cached
+#   session is ignored if the file can be read or written by anyone else.
+def load_session():
+    try:
+        st = os.stat(ZSESSION_CACHE)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            print(f"[WARNING] Ignoring the session cache {ZSESSION_CACHE}, it's accessible by others.")
+            return None
+        with open(ZSESSION_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("url") != ZURL or cached.get("user") != ZUSER or cached.get("expires", 0) < time.time():
+        return None
+    return cached.get("sessionid")
+
+def save_session(sessionid):
+    try:
+        os.makedirs(os.path.dirname(ZSESSION_CACHE), mode=0o700, exist_ok=True)
+        tmp = ZSESSION_CACHE + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"url": ZURL, "user": ZUSER, "sessionid": sessionid,
+                       "expires": time.time() + float(ZSESSION_TTL)}, f)
+        os.replace(tmp, ZSESSION_CACHE)
+    except OSError as e:
+        print(f"[WARNING] Cannot write the session cache {ZSESSION_CACHE}: {e}")
+
+# log in with user and password, reusing the cached session if it's still valid
+#   user.checkAuthentication validates the cached session (and extends it) in one cheap call.
+#   Without a session cache, the session is logged out at exit, so that none are left behind.
+def login(zobj, verbosity=False):
+    if ZSESSION_CACHE:
+        sessionid = load_session()
+        if sessionid:
+            try:
+                zobj.user.checkAuthentication(sessionid=sessionid)
+                zobj.auth = sessionid
+                save_session(sessionid)
+                if verbosity:
+                    print("[INFO] Using the cached session.")
+                return
+            except ZabbixAPIException:
+                if verbosity:
+                    print("[INFO] The cached session is no longer valid, logging in.")
+    zobj.login(ZUSER, ZPASSWORD)
+    if ZSESSION_CACHE:
+        save_session(zobj.auth)
+    else:
+        atexit.register(zobj.user.logout)
+
+# manifest loader
+#   The manifest is a JSON (or YAML, with PyYAML installed) file like:
+#   {
+#     "defaults": {"history": "365d", "trends": "365d", "value_type": 0, "units": ""},
+#     "hosts": [
+#       {"name": "PerfTest-OpenSSL-master", "group": "Applications",
+#        "items": ["perftest.pemread-1", {"name": "perftest.handshakes-per-second-1", "units": "hs/s"}]}
+#     ]
+#   }
+#   An item is either its name, or an object with the name and any of "key" (the name by default),
+#   "value_type", "history", "trends" and "units", overriding the defaults.
+#   Returns {host name: {"group": group name, "items": {item key: item}}}
+def load_manifest(path):
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ImportError:
+                print("[ERROR] YAML manifests need the PyYAML module (pip3 install pyyaml). Quitting...")
+                sys.exit(1)
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    defaults = dict(ITEM_DEFAULTS, **manifest.get("defaults", {}))
+    hosts = {}
+    for h in manifest.get("hosts", []):
+        items = {}
+        for i in h.get("items", []):
+            item = dict(defaults, **({"name": i} if isinstance(i, str) else i))
+            item["key_"] = item.pop("key", item["name"])
+            for k in ("history", "trends"):
+                if not re.match("^[0-9]+[dh]{1}$", item[k]):
+                    print(f"[ERROR] {path}: item '{item['name']}': bad {k} '{item[k]}'. Quitting...")
+                    sys.exit(1)
+            items[item["key_"]] = item
+        hosts[h["name"]] = {"group": h.get("group", DEFAULT_HOSTGROUP), "items": items}
+    return hosts
+
+# fields of an item compared in reconcile mode
+RECONCILED_FIELDS = ("name", "value_type", "history", "trends", "units")
+
+# run the API method |method| on |params| in batches of BATCH_SIZE, returns the number of failed batches
+def batched(method, params):
+    errors = 0
+    for n in range(0, len(params), BATCH_SIZE):
+        try:
+            method(*params[n:n + BATCH_SIZE])
+        except ZabbixAPIException as e:
+            print(e)
+            errors += 1
+    return errors
+
+# create the hosts and items of the manifest that don't exist yet
+#   The existing hosts and their items are fetched with one host.get, the missing hosts are created
+#   with one host.create, and the missing items with one item.create per BATCH_SIZE items.
+#   With |reconcile|, the existing items whose RECONCILED_FIELDS differ from the manifest are
+#   updated, and with |prune| the trapper items of the manifest's hosts that are not in the manifest
+#   are deleted, again BATCH_SIZE items per call.
+def provision(zobj, hosts, dryrun=False, verbosity=False, reconcile=False, prune=False):
+    existing = zobj.host.get(filter={"host": list(hosts)}, output=["hostid", "host"],
+                             selectItems=["itemid", "key_", "type", *RECONCILED_FIELDS])
+    hostids = {h["host"]: h["hostid"] for h in existing}
+    existing_items = {h["host"]: {i["key_"]: i for i in h["items"]} for h in existing}
+    # missing hosts
+    missing = [name for name in hosts if name not in hostids]
+    if missing:
+        groups = {hosts[name]["group"] for name in missing}
+        groupids = {g["name"]: g["groupid"] for g in zobj.hostgroup.get(filter={"name": list(groups)})}
+        for g in groups - set(groupids):
+            print(f"[ERROR] Host group '{g}' doesn't exist. Quitting...")
+            sys.exit(1)
+        for name in missing:
+            print(f"[INFO] {'Would create' if dryrun else 'Creating'} host '{name}'.")
+        if not dryrun:
+            try:
+                created = zobj.host.create(*[{"host": name, "groups": [{"groupid": groupids[hosts[name]["group"]]}]}
+                                             for name in missing])
+            except ZabbixAPIException as e:
+                print(e)
+                sys.exit(1)
+            hostids.update(zip(missing, created["hostids"]))
+    # missing and changed items
+    new_items = []
+    changed_items = []
+    for name, host in hosts.items():
+        current = existing_items.get(name, {})
+        for key, item in host["items"].items():
+            if key not in current:
+                print(f"[INFO] {'Would add' if dryrun else 'Adding'} item '{key}' to host '{name}'.")
+                new_items.append(dict(item, hostid=hostids.get(name),
+                                      # type=2 is the "TRAP" type in Zabbix
+                                      type=2))
+                continue
+            changes = {f: item[f] for f in RECONCILED_FIELDS
+                       if reconcile and str(item[f]) != str(current[key].get(f))}
+            if changes:
+                diff = ", ".join(f"{f} '{current[key].get(f)}' -> '{v}'" for f, v in changes.items())
+                print(f"[INFO] {'Would update' if dryrun else 'Updating'} item '{key}' on host '{name}': {diff}.")
+                changed_items.append(dict(changes, itemid=current[key]["itemid"]))
+            elif verbosity:
+                print(f"[INFO] Item '{key}' already exists on host '{name}'.")
+    # items not in the manifest
+    stale_items = []
+    if prune:
+        for name, host in hosts.items():
+            for key, item in existing_items.get(name, {}).items():
+                if key not in host["items"] and str(item.get("type")) == "2":
+                    print(f"[INFO] {'Would delete' if dryrun else 'Deleting'} item '{key}' from host '{name}'.")
+                    stale_items.append(item["itemid"])
+    summary = (f"{len(missing)} hosts and {len(new_items)} items to create, "
+               f"{len(changed_items)} items to update, {len(stale_items)} items to delete")
+    if dryrun:
+        print(f"Dry run, {summary}.")
+        return
+    errors = batched(zobj.item.create, new_items) + \
+        batched(zobj.item.update, changed_items) + \
+        batched(zobj.item.delete, stale_items)
+    print(f"[INFO] Done, {summary}{f', {errors} batches failed' if errors else ''}.")
+    if errors:
+        sys.exit(1)
+
 def main():
     ap = argparse.ArgumentParser(prog="TMA, Test Metrics Automation",
                                 description="Tool to add hosts and items for test automation to Zabbix server.")
@@ -49,10 +237,18 @@ def main():
                     help="Keep trends for N hours/days, like: 8h, 14d, .... Default value is 365d.")
     ap.add_argument("-u", "--units", dest="hostname_item_units",
                     help="Units, shown in graphs.")
+    ap.add_argument("-f", "--manifest", dest="manifest",
+                    help="Create all the hosts and items of this JSON/YAML manifest that don't exist yet, instead of one item.")
+    ap.add_argument("-r", "--reconcile", action="store_true", dest="reconcile",
+                    help="With -f, also update the existing items whose name, value type, history, trends or units differ from the manifest.")
+    ap.add_argument("-p", "--prune", action="store_true", dest="prune",
+                    help="With -f, also delete the trapper items of the manifest's hosts that are not in the manifest.")
     ap.add_argument("-c", "--config", dest="config",
                     help="Configuration file.")
     ap.add_argument("-m", "--make-config", action="store_true", dest="makeconfig",
                     help="Generate the configuration file and exit. If -c option is used, its argument is the destination for the new config file.")
+    ap.add_argument("--no-session-cache", action="store_true", dest="nosessioncache",
+                    help="Don't reuse or keep the session of the user, log in and out instead.")
     ap.add_argument("-v", "--verbose", action="store_true", dest="verbosity",
                     help="Verbosity.")
     ap.add_argument("-d", "--dry-run", action="store_true", dest="dryrun",
@@ -79,8 +275,14 @@ def main():
                 k, v = map(str.strip, line.partition("=")[::2])
                 if k in globals():
                     globals()[k] = v
+    if args.nosessioncache:
+        globals()["ZSESSION_CACHE"] = ""
+    elif ZSESSION_CACHE:
+        globals()["ZSESSION_CACHE"] = os.path.expanduser(ZSESSION_CACHE)
     # parameters check
-    if not args.hostname_name or \
+    if args.manifest:
+        hosts = load_manifest(args.manifest)
+    elif not args.hostname_name or \
        not args.hostname_item_name or \
        not re.match("^[0-9]+[dh]{1}$", args.hostname_item_history) or \
        not re.match("^[0-9]+[dh]{1}$", args.hostname_item_history):
@@ -93,7 +295,7 @@ def main():
         if args.verbosity:
             print("[INFO] Using user and password authentication.")
         try:
-            zobj.login(ZUSER, ZPASSWORD)
+            login(zobj, args.verbosity)
         except:
             print("[ERROR] Authentication with login and password failed. Quitting...")
             sys.exit(1)
@@ -105,16 +307,20 @@ def main():
         except:
             print("[ERROR] Authentication with token failed. Quitting...")
             sys.exit(1)
+        # the token is not checked by the login, so check the connection
+        try:
+            zobj.api_version()
+            if args.verbosity:
+                print("[INFO] Connection established successfuly.")
+        except:
+            print("[ERROR] Connection failed. Quitting...")
+            sys.exit(1)
     else:
         print("No credentials set. Cannot authenticate against Zabbix server. Quitting...")
         sys.exit(1)
-    try:
-        zobj.api_version()
-        if args.verbosity:
-            print("[INFO] Connection established successfuly.")
-    except:
-        print("[ERROR] Connection failed. Quitting...")
-        sys.exit(1)
+    if args.manifest:
+        provision(zobj, hosts, args.dryrun, args.verbosity, args.reconcile, args.prune)
+        sys.exit(0)
     if args.dryrun:
         print("Dry run, finishing here.")
         sys.exit(0)
@@ -26,6 +26,7 @@ function print_help() {
     echo "        -d ...... dry run, don't send results anywhere"
     echo "        -h ...... this help"
     echo "        -r <repeat test N times>"
+    echo "        -s <spool file> for results that cannot be sent, see perftest_wrapper.sh"
     echo "        -t <number of threads>"
     MAXLEN=0
     for i in ${ALLOWED_THREADS[@]}; do [ ${#i} -gt ${MAXLEN} ] && MAXLEN=${#i}; done
@@ -56,7 +57,7 @@ function print_help() {
 
 # arguments parser
 function parse_args() {
-    while getopts 'dhr:t:V:vz:' option; do
+    while getopts 'dhr:s:t:V:vz:' option; do
     case "${option}" in
         # dry run
         d)
@@ -104,6 +105,14 @@ function parse_args() {
             done
             [ "${OSSL_VERSION}" != "${OPTARG}" ] && print_help && exit 1
             ;;
+        # spool file, passed to perftest_wrapper
+        s)
+            if [ -z "${OPTARG}" ]; then
+                print_help
+                exit 1
+            fi
+            OPTS+=" -s ${OPTARG}"
+            ;;
         # verbosity
         v)
             VERBOSITY=1
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+# Performance test harness
+#
+# Runs the performance tests (handshakes per second, pemread) for the
+# given OpenSSL version and thread counts, each REPEAT times, and sends
+# statistics of the results to Zabbix server in one batch, with the Zabbix
+# sender protocol (zabbixsender.py, from github-stat-tools, which
+# ../install.sh copies next to this script).
+#
+# Compared to the shell scripts, each test run can yield several metrics,
+# outliers are dropped before the statistics are computed, and all the
+# values of a run go in one batch.  The median is sent under the same
+# metric titles as the shell scripts do; the other statistics are sent as
+# "<metric title>.<statistic>", for example "perftest.pemread-1.stddev".
+# These items have to exist in Zabbix server (see ../metrics-automation).
+import sys, argparse, os, re, subprocess, statistics, time, fcntl, shlex
+
+# zabbixsender.py is next to this script once installed, and in github-stat-tools in the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "github-stat-tools"))
+from zabbixsender import ZabbixSender, ZabbixError
+
+BUILDS_DIR = "/opt/openssl/tests/build"
+ALLOWED_OSSL_VERSIONS = ("master", "1.1.1", "3.0", "3.1")
+ALLOWED_THREADS = (1, 10, 100, 500, 1000)
+ZABBIX_SERVER = "127.0.0.1"
+STATISTICS = ("median", "mean", "stddev", "min", "max", "p10", "p90")
+DEFAULT_STATISTICS = ("median", "stddev", "p10", "p90")
+# the spool file is rotated over SPOOL_MAX_SIZE bytes, like perftest_wrapper.sh does
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+# values per request to Zabbix server, like zabbix_sender does
+ZABBIX_CHUNK = 250
+# samples further than OUTLIER_MADS median absolute deviations from the median are dropped
+OUTLIER_MADS = 3.0
+
+# tests
+#   For each test: the command to run, with {builds}, {version} and {threads} to fill in, and the
+#   metrics found in its output, as (metric title, pattern whose first group is the value).
+TESTS = {
+    "handshakes": {
+        "command": ["{builds}/{version}-tools/perf/handshake", "{builds}/{version}/test/certs", "{threads}"],
+        "metrics": [
+            ("perftest.handshakes-per-second-{threads}", r"Handshakes per second:\s*([0-9.]+)"),
+            ("perftest.handshake-time-{threads}", r"Average time per handshake:\s*([0-9.]+)us"),
+        ],
+    },
+    "pemread": {
+        "command": ["{builds}/{version}-tools/perf/pemread", "{threads}"],
+        "metrics": [
+            ("perftest.pemread-{threads}", r"^.*: ([0-9]+\.[0-9]+)us$"),
+        ],
+    },
+}
+
+# run one test once, returns {metric title: value} of what was found in its output
+def run_test(test, version, threads, builds=BUILDS_DIR, timeout=600, verbosity=False):
+    spec = TESTS[test]
+    fill = {"builds": builds, "version": version, "threads": threads}
+    command = [arg.format(**fill) for arg in spec["command"]]
+    env = dict(os.environ, LD_LIBRARY_PATH=f"{builds}/{version}")
+    if verbosity:
+        print(f"Running: {' '.join(command)}")
+    try:
+        result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                timeout=timeout, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        print(f"[ERROR] '{' '.join(command)}' timed out after {timeout}s.")
+        return {}
+    if result.returncode != 0:
+        print(f"[ERROR] '{' '.join(command)}' failed with exit code {result.returncode}:")
+        print(result.stdout)
+        return {}
+    values = {}
+    for title, pattern in spec["metrics"]:
+        m = re.search(pattern, result.stdout, flags=re.MULTILINE)
+        if m:
+            values[title.format(**fill)] = float(m.group(1))
+        else:
+            print(f"[WARNING] No value for '{title.format(**fill)}' in the output of '{' '.join(command)}'.")
+    if verbosity:
+        print(f"    Result: {values}")
+    return values
+
+# drop the samples further than |mads| median absolute deviations from the median, 0 keeps them all
+#   With fewer than 5 samples, there are too few to tell what an outlier is, so they are all kept.
+def reject_outliers(samples, mads=OUTLIER_MADS):
+    if mads <= 0 or len(samples) < 5:
+        return samples
+    median = statistics.median(samples)
+    mad = statistics.median(abs(s - median) for s in samples)
+    if mad == 0:
+        return samples
+    return [s for s in samples if abs(s - median) <= mads * mad]
+
+# statistics of |samples|, {name: value} for each of STATISTICS
+def describe(samples):
+    if len(samples) > 1:
+        percentiles = statistics.quantiles(samples, n=10, method="inclusive")
+        stddev = statistics.stdev(samples)
+    else:
+        percentiles = samples * 9
+        stddev = 0.0
+    return {
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stddev": stddev,
+        "min": min(samples),
+        "max": max(samples),
+        "p10": percentiles[0],
+        "p90": percentiles[8],
+    }
+
+# spool line of one value, in the zabbix_sender -T input format that perftest_wrapper.sh uses
+def spool_line(group, title, clock, value):
+    if isinstance(value, float):
+        value = f"{value:.6g}"
+    return f'"{group}" "{title}" {int(clock)} {value}\n'
+
+# (group title, metric title, timestamp, value) of a spool line, None if it's cut short
+def parse_spool_line(line):
+    try:
+        group, title, clock, value = shlex.split(line)
+        return group, title, int(clock), value
+    except ValueError:
+        return None
+
+# send |items|, a list of (group title, metric title, timestamp, value), in requests of ZABBIX_CHUNK values
+#   Returns how many of them the server answered for, and how many of those it refused.
+def send_items(sender, items):
+    failed = 0
+    items = [(group, title, value, clock) for group, title, clock, value in items]
+    for n in range(0, len(items), ZABBIX_CHUNK):
+        try:
+            summary = sender.send(items[n:n + ZABBIX_CHUNK])
+        except (OSError, ZabbixError) as e:
+            print(f"[ERROR] Sending to Zabbix server failed: {e}")
+            return n, failed
+        print(f"[INFO] Zabbix server: processed: {summary.get('processed')}; failed: {summary.get('failed')}; "
+              f"total: {summary.get('total')}")
+        failed += summary.get("failed", 0)
+    return len(items), failed
+
+# send all the |values|, a list of (group title, metric title, timestamp, value), in one batch
+#   With a |spool| file, the values are appended to it, and the spool is sent, oldest first, under the
+#   same lock as perftest_wrapper.sh -s takes.  What the server answered for is removed from the spool,
+#   since values that it refused would be refused again; the rest stays there for the next run.  The
+#   spool is rotated over SPOOL_MAX_SIZE bytes, and only one rotation is kept, like the wrapper does.
+def send(server, values, spool=None):
+    sender = ZabbixSender(server)
+    if not spool:
+        sent, failed = send_items(sender, values)
+        return sent == len(values) and failed == 0
+    with open(f"{spool}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(spool, "a") as f:
+            f.writelines(spool_line(*v) for v in values)
+        answered = True
+        refused = 0
+        for name in (f"{spool}.1", spool):
+            if not os.path.exists(name):
+                continue
+            with open(name) as f:
+                lines = f.readlines()
+            items = [i for i in map(parse_spool_line, lines) if i]
+            sent, failed = send_items(sender, items)
+            refused += failed
+            if sent == len(items):
+                os.remove(name)
+                continue
+            answered = False
+            with open(f"{name}.tmp", "w") as f:
+                f.writelines(spool_line(*i) for i in items[sent:])
+            os.replace(f"{name}.tmp", name)
+            print(f"[INFO] {len(items) - sent} values left in {name}.")
+            break
+        if os.path.exists(spool) and os.path.getsize(spool) > SPOOL_MAX_SIZE:
+            os.replace(spool, f"{spool}.1")
+    return answered and refused == 0
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the performance tests and send the results to Zabbix server.")
+    ap.add_argument("-T", "--test", action="append", choices=sorted(TESTS), dest="tests",
+                    help="Test to run, can be repeated. All of them by default.")
+    ap.add_argument("-V", "--version", choices=ALLOWED_OSSL_VERSIONS, default=ALLOWED_OSSL_VERSIONS[0],
+                    help=f"OpenSSL version to run on, default is {ALLOWED_OSSL_VERSIONS[0]}.")
+    ap.add_argument("-t", "--threads", type=int, choices=(0,) + ALLOWED_THREADS, default=1,
+                    help="Number of threads, 0 runs with all the allowed values. Default is 1.")
+    ap.add_argument("-r", "--repeat", type=int, default=5,
+                    help="Repeat each test N times. Default is 5.")
+    ap.add_argument("-o", "--outliers", type=float, default=OUTLIER_MADS,
+                    help=f"Drop results further than N median absolute deviations from the median, 0 keeps them all. Default is {OUTLIER_MADS}.")
+    ap.add_argument("-S", "--statistics", default=",".join(DEFAULT_STATISTICS),
+                    help=f"Comma separated statistics to send, of: {', '.join(STATISTICS)}. Default is {','.join(DEFAULT_STATISTICS)}.")
+    ap.add_argument("-b", "--builds-dir", default=BUILDS_DIR, dest="builds",
+                    help=f"Directory of the OpenSSL builds, default is {BUILDS_DIR}.")
+    ap.add_argument("--timeout", type=int, default=600,
+                    help="Timeout of one test run in seconds. Default is 600.")
+    ap.add_argument("-s", "--spool", help="Spool file for results that cannot be sent, see perftest_wrapper.sh.")
+    ap.add_argument("-z", "--zabbix-server", default=ZABBIX_SERVER, dest="server",
+                    help=f"Zabbix server IP address / hostname, default is {ZABBIX_SERVER}.")
+    ap.add_argument("-d", "--dry-run", action="store_true", dest="dryrun",
+                    help="Dry run, print the results instead of sending them.")
+    ap.add_argument("-v", "--verbose", action="store_true", dest="verbosity",
+                    help="Verbosity.")
+    args = ap.parse_args()
+    stats = args.statistics.split(",")
+    for s in stats:
+        if s not in STATISTICS:
+            ap.error(f"unknown statistic '{s}'")
+    if args.repeat <= 0:
+        ap.error("the repeat count must be positive")
+
+    group = f"PerfTest-OpenSSL-{args.version}"
+    clock = time.time()
+    values = []
+    for test in args.tests or sorted(TESTS):
+        for threads in ALLOWED_THREADS if args.threads == 0 else (args.threads,):
+            print("----")
+            print(f"Running test '{test}' with {threads} threads, {args.repeat} times")
+            samples = {}
+            for i in range(args.repeat):
+                for title, value in run_test(test, args.version, threads, args.builds,
+                                             args.timeout, args.verbosity).items():
+                    samples.setdefault(title, []).append(value)
+            for title, s in samples.items():
+                kept = reject_outliers(s, args.outliers)
+                if len(kept) < len(s):
+                    print(f"[INFO] '{title}': dropped {len(s) - len(kept)} outliers of {len(s)} results.")
+                d = describe(kept)
+                print(f"[Test] '{title}' " + ", ".join(f"{k}={d[k]:.6g}" for k in stats))
+                values.extend((group, title if k == "median" else f"{title}.{k}", clock, d[k]) for k in stats)
+
+    if not values:
+        print("Error: no results, nothing to report. Quitting...")
+        sys.exit(1)
+    if args.dryrun:
+        print(f"Dry run, {len(values)} values are not sent to Zabbix server.")
+        sys.exit(0)
+    sys.exit(0 if send(args.server, values, args.spool) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ CMD=""
 GROUP_TITLE="Performance tests"
 METRIC_TITLE=""
 METRIC_VALUE=
+SPOOL_FILE=""
+SPOOL_MAX_SIZE=$((10 * 1024 * 1024))
 
 # print help
 function print_help() {
@@ -21,6 +23,8 @@ function print_help() {
     echo "        -h ... print this help"
     echo "        -m <metric title>"
     echo "                ... this is defined as an 'item' in Zabbix server"
+    echo "        -s <spool file>"
+    echo "                ... values that cannot be sent are kept there, and sent with the next value"
     echo "        -v ... set verbosity"
     echo "        -z <Zabbix server IP address / hostname>"
     echo
@@ -31,7 +35,7 @@ function print_help() {
 # arguments parser
 function parse_args() {
     [ $# -eq 0 ] && print_help && exit 1
-    while getopts 'c:dg:hm:vz:' option; do
+    while getopts 'c:dg:hm:s:vz:' option; do
     case "${option}" in
         # command
         c)
@@ -69,6 +73,14 @@ function parse_args() {
             fi
             METRIC_TITLE=${OPTARG}
             ;;
+        # spool file
+        s)
+            if [ -z "${OPTARG}" ]; then
+                print_help
+                exit 1
+            fi
+            SPOOL_FILE=${OPTARG}
+            ;;
         # verbosity
         v)
             VERBOSITY=1
@@ -111,8 +123,12 @@ function test_vars() {
         which zabbix_sender 2>&1 >/dev/null && {
             zabbix_sender -z ${ZABBIX_SERVER} -s "this_connection_test_host" -k "connection_test_key" -o 1 | grep -q 'sent: 1;'
             if [ $? -ne 0 ]; then
-                echo "Error: Zabbix server is not accessible."
-                err=1
+                if [ -n "${SPOOL_FILE}" ]; then
+                    echo "Warning: Zabbix server is not accessible, the value will be spooled."
+                else
+                    echo "Error: Zabbix server is not accessible."
+                    err=1
+                fi
             fi
         } ||
         { echo "Error: zabbix_sender must be installed."; err=1; }
@@ -120,6 +136,33 @@ function test_vars() {
     fi
 }
 
+# send the value through the spool file
+#   The value is appended to the spool with its time stamp, and everything
+#   spooled is sent in one go.  If the server can't be reached, it all stays
+#   in the spool for the next run.  The spool is rotated once it grows over
+#   SPOOL_MAX_SIZE, and only one rotation is kept, so what's dropped in a
+#   long outage is the oldest values.
+function send_spooled() {
+    local sending="${SPOOL_FILE}.sending"
+    local output
+    (
+        flock 9
+        printf '"%s" "%s" %s %s\n' "${GROUP_TITLE}" "${METRIC_TITLE}" "${TIMESTAMP}" "${METRIC_VALUE}" >> "${SPOOL_FILE}"
+        cat "${SPOOL_FILE}.1" "${SPOOL_FILE}" 2>/dev/null > "${sending}"
+        output=$(zabbix_sender -z ${ZABBIX_SERVER} -T -i "${sending}" 2>&1)
+        rm -f "${sending}"
+        # values that the server refused would be refused again, so the
+        # spool is emptied as soon as the server answered
+        if echo "${output}" | grep -q 'processed:'; then
+            rm -f "${SPOOL_FILE}" "${SPOOL_FILE}.1"
+            exit 0
+        fi
+        if [ $(stat -c %s "${SPOOL_FILE}") -gt ${SPOOL_MAX_SIZE} ]; then
+            mv -f "${SPOOL_FILE}" "${SPOOL_FILE}.1"
+        fi
+        exit 1
+    ) 9>>"${SPOOL_FILE}.lock"
+}
 
 # ****** START ******
 # arguments
@@ -132,6 +175,7 @@ if [ ${VERBOSITY} -ne 0 ]; then
     echo "GROUP_TITLE    = ${GROUP_TITLE}"
     echo "METRIC_TITLE   = ${METRIC_TITLE}"
     echo "ZABBIX_SERVER  = ${ZABBIX_SERVER}"
+    echo "SPOOL_FILE     = ${SPOOL_FILE}"
     echo "CMD            = ${CMD}"
     echo "***********************"
     echo
@@ -155,8 +199,12 @@ if [ ${VERBOSITY} -ne 0 ]; then
 fi
 if [ ${DRY_RUN} -eq 0 ]; then
     # sending data to Zabbix server
-    eval ${CMD2RUN}
-    [ $? -eq 0 ] && echo "[Zabbix] '${METRIC_TITLE}'->${METRIC_VALUE} .... PASSED" || echo "[Zabbix] '${METRIC_TITLE}'->${METRIC_VALUE} .... FAILED"
+    if [ -n "${SPOOL_FILE}" ]; then
+        send_spooled && RESULT=PASSED || RESULT=SPOOLED
+    else
+        eval ${CMD2RUN} && RESULT=PASSED || RESULT=FAILED
+    fi
+    echo "[Zabbix] '${METRIC_TITLE}'->${METRIC_VALUE} .... ${RESULT}"
 else
     echo "Dry run, data are not sent to Zabbix server."
     echo "[Test] '${METRIC_TITLE}'->${METRIC_VALUE}"